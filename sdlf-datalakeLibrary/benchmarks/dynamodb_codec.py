@@ -0,0 +1,73 @@
+"""Micro-benchmark of datalake_library's DynamoDB codec against boto3's TypeSerializer/TypeDeserializer.
+
+Items mimic the object metadata catalog and pipeline execution history records written by the stages.
+
+    python benchmarks/dynamodb_codec.py --items 10000 --repeat 5
+"""
+
+import argparse
+import os
+import sys
+import timeit
+from decimal import Decimal
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python"))
+
+from datalake_library.commons import dynamodb_codec
+
+
+def build_page(num_items):
+    return [
+        {
+            "id": f"s3://sdlf-raw-bucket/legislators/persons/part-{i:06d}.json",
+            "bucket": "sdlf-raw-bucket",
+            "key": f"legislators/persons/part-{i:06d}.json",
+            "size": 1024 * i,
+            "timestamp": 1700000000000 + i,
+            "last_modified_date": "2024-10-01T12:00:00+00:00",
+            "active": i % 2 == 0,
+            "duration_in_seconds": Decimal("12.345"),
+            "history": [{"status": "STARTED", "timestamp": "2024-10-01T12:00:00+00:00"}],
+            "tags": {"team": "legislators", "dataset": "persons", "stage": "raw"},
+            "comment": None,
+        }
+        for i in range(num_items)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=10000, help="number of items per page")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed runs, the best one is reported")
+    args = parser.parse_args()
+
+    page = build_page(args.items)
+    serializer, deserializer = TypeSerializer(), TypeDeserializer()
+    serialized_page = [{k: serializer.serialize(v) for k, v in item.items()} for item in page]
+    assert dynamodb_codec.serialize_many(page) == serialized_page
+    assert dynamodb_codec.deserialize_many(serialized_page) == page
+
+    cases = {
+        "serialize": (
+            lambda: [{k: serializer.serialize(v) for k, v in item.items()} for item in page],
+            lambda: dynamodb_codec.serialize_many(page),
+        ),
+        "deserialize": (
+            lambda: [{k: deserializer.deserialize(v) for k, v in item.items()} for item in serialized_page],
+            lambda: dynamodb_codec.deserialize_many(serialized_page),
+        ),
+    }
+    print(f"{args.items} items per page, best of {args.repeat} runs")
+    for name, (boto3_path, codec_path) in cases.items():
+        boto3_time = min(timeit.repeat(boto3_path, number=1, repeat=args.repeat))
+        codec_time = min(timeit.repeat(codec_path, number=1, repeat=args.repeat))
+        print(
+            f"{name:<12} boto3: {boto3_time * 1000:8.1f} ms  codec: {codec_time * 1000:8.1f} ms  "
+            f"speedup: {boto3_time / codec_time:4.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Cold-start import time of datalake_library modules, measured with python -X importtime in fresh interpreters.
+
+Each module is imported --runs times in a new process, so nothing is cached in sys.modules. The median of the total
+import time is reported, with the slowest modules it pulled in. --max-ms makes the run fail above a budget, to track
+regressions in CI.
+
+    python benchmarks/import_time.py --runs 10 --top 5
+    python benchmarks/import_time.py --modules datalake_library.sdlf --max-ms 150
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+PYTHON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python")
+
+# what routing, redrive and error functions import, then the heavier data quality module
+MODULES = (
+    "datalake_library.sdlf",
+    "datalake_library.sdlf.config",
+    "datalake_library.sdlf.peh",
+    "datalake_library.interfaces.sqs_interface",
+    "datalake_library.interfaces.states_interface",
+    "datalake_library.interfaces.s3_interface",
+    "datalake_library.interfaces.dynamo_interface",
+    "datalake_library.data_quality.schema_validator",
+)
+
+
+def import_times(module):
+    """Returns the cumulative import time in microseconds of module and of each module imported along the way"""
+    env = dict(os.environ, PYTHONPATH=PYTHON_PATH)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if result.returncode:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.splitlines()[-1]}")
+    times, total = {}, 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative)
+        if not name.startswith("  "):  # modules imported by the statement itself, not by another module
+            total += int(cumulative)
+    return total, times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modules", default=",".join(MODULES), help="comma separated modules to import")
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters per module")
+    parser.add_argument("--top", type=int, default=5, help="slowest imported modules shown per module")
+    parser.add_argument("--max-ms", type=float, help="fail if a module takes longer to import")
+    args = parser.parse_args()
+
+    over_budget = []
+    for module in args.modules.split(","):
+        try:
+            runs = [import_times(module) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"{module:<48} skipped: {e}")
+            continue
+        total = statistics.median(total for total, _ in runs) / 1000
+        print(f"{module:<48} {total:8.1f} ms")
+        # slowest dependencies of the last run, the module itself excluded
+        _, times = runs[-1]
+        slowest = sorted(((time, name) for name, time in times.items() if name != module), reverse=True)
+        for time, name in slowest[: args.top]:
+            print(f"    {name.strip():<44} {time / 1000:8.1f} ms")
+        if args.max_ms and total > args.max_ms:
+            over_budget.append(module)
+
+    if over_budget:
+        sys.exit(f"over the {args.max_ms} ms budget: {', '.join(over_budget)}")
+
+
+if __name__ == "__main__":
+    main()
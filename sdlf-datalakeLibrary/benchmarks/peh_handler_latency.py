@@ -0,0 +1,110 @@
+"""Latency of a postupdate-metadata style handler using PipelineExecutionHistoryAPI, with simulated AWS round trips.
+
+"eager" reproduces the previous constructor: account id and table names resolved on every construction, without
+any process-level caching. "lazy" is the current behaviour where both are resolved on first use and cached.
+
+    python benchmarks/peh_handler_latency.py --invocations 20 --latency-ms 15
+"""
+
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python"))
+os.environ.setdefault("AWS_REGION", "us-east-1")
+
+from datalake_library.sdlf import config, peh
+
+
+class SimulatedAWS:
+    """Stands in for the sts, ssm and dynamodb clients, each call costs one simulated round trip"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self.items = {}
+
+    def _round_trip(self):
+        self.calls += 1
+        time.sleep(self.latency)
+
+    def get_caller_identity(self):
+        self._round_trip()
+        return {"Account": "111111111111"}
+
+    def get_parameters(self, Names):
+        self._round_trip()
+        return {"Parameters": [{"Name": name, "Value": "sdlf-" + name.split("/")[3]} for name in Names]}
+
+    def put_item(self, TableName, Item, **kwargs):
+        self._round_trip()
+        self.items[Item["id"]["S"]] = Item
+
+    def get_item(self, TableName, Key, **kwargs):
+        self._round_trip()
+        return {"Item": self.items[Key["id"]["S"]]}
+
+    def update_item(self, TableName, Key, **kwargs):
+        self._round_trip()
+        return {}
+
+
+def handler(peh_id, eager):
+    pipeline_execution = peh.PipelineExecutionHistoryAPI(
+        run_in_context="LAMBDA", peh_table_instance="dev", manifests_table_instance="dev"
+    )
+    if eager:
+        # resolved upfront, as the previous constructor did
+        _ = pipeline_execution.account_id, pipeline_execution.peh_table
+    pipeline_execution.retrieve_pipeline_execution(peh_id)
+    pipeline_execution.update_pipeline_execution(status="dev Postupdate Processing", component="Postupdate")
+    pipeline_execution.end_pipeline_execution_success()
+
+
+def run(invocations, latency, eager):
+    aws = SimulatedAWS(latency)
+    peh.get_client = config.get_client = lambda *args, **kwargs: aws
+    peh_ids = [str(uuid.uuid4()) for _ in range(invocations)]
+    for peh_id in peh_ids:
+        aws.items[peh_id] = {
+            "id": {"S": peh_id},
+            "pipeline": {"S": "dev"},
+            "active": {"BOOL": True},
+            "version": {"N": "1"},
+            "start_timestamp": {"S": "2024-10-01T12:00:00.000000+00:00"},
+        }
+    peh.PipelineExecutionHistoryAPI._account_id = None
+    peh.PipelineExecutionHistoryAPI._dynamo_configs.clear()
+    config.ssm_parameters.invalidate()
+
+    latencies = []
+    for peh_id in peh_ids:
+        if eager:
+            peh.PipelineExecutionHistoryAPI._account_id = None
+            peh.PipelineExecutionHistoryAPI._dynamo_configs.clear()
+            config.ssm_parameters.invalidate()
+        start = time.perf_counter()
+        handler(peh_id, eager)
+        latencies.append(time.perf_counter() - start)
+    return latencies, aws.calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invocations", type=int, default=20, help="number of consecutive (warm) invocations")
+    parser.add_argument("--latency-ms", type=float, default=15, help="simulated latency of one AWS API call")
+    args = parser.parse_args()
+
+    for name, eager in (("eager", True), ("lazy", False)):
+        latencies, calls = run(args.invocations, args.latency_ms / 1000, eager)
+        warm = sorted(latencies[1:]) or latencies
+        print(
+            f"{name:<6} first: {latencies[0] * 1000:6.1f} ms  warm p50: {warm[len(warm) // 2] * 1000:6.1f} ms  "
+            f"API calls: {calls / args.invocations:4.1f}/invocation"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Throughput of S3Interface reads: read_object against streaming, range-parallel and memoryview reads.
+
+Runs against a real bucket with the credentials of the environment. Test objects are uploaded under --prefix
+(streamed, they are never held in memory) unless they already exist, and are left in place for later runs.
+
+    python benchmarks/s3_read.py --bucket my-sdlf-artifacts --sizes 10MB,1GB,5GB --workers 8
+
+read_object decodes the whole object into a StringIO, it is skipped above --max-text-size to stay within memory.
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+import boto3
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python"))
+
+from datalake_library.interfaces.s3_interface import S3Interface
+
+UNITS = {"KB": 1024, "MB": 1024**2, "GB": 1024**3}
+
+
+def parse_size(size):
+    return int(float(size[:-2]) * UNITS[size[-2:].upper()])
+
+
+class TextLines(io.RawIOBase):
+    """File-like producing size bytes of newline terminated text lines, uploaded without buffering them"""
+
+    def __init__(self, size):
+        self.remaining = size
+        self.line = b"2024-10-01T12:00:00Z,legislators,persons,raw,s3://sdlf-raw-bucket/legislators/persons.json\n"
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self.remaining)
+        repeated = self.line * (length // len(self.line) + 1)
+        buffer[:length] = repeated[:length]
+        self.remaining -= length
+        return length
+
+
+def ensure_object(s3, bucket, key, size):
+    try:
+        if s3.head_object(Bucket=bucket, Key=key)["ContentLength"] == size:
+            return
+    except s3.exceptions.ClientError:
+        pass
+    print(f"uploading s3://{bucket}/{key}")
+    s3.upload_fileobj(io.BufferedReader(TextLines(size), 8 * 1024**2), bucket, key)
+
+
+def timed(function):
+    start = time.perf_counter()
+    size = function()
+    return size, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--prefix", default="benchmarks/s3_read")
+    parser.add_argument("--sizes", default="10MB,1GB,5GB", help="comma separated object sizes")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent range GETs of parallel reads")
+    parser.add_argument("--max-text-size", default="1GB", help="largest object read with read_object")
+    args = parser.parse_args()
+
+    s3 = boto3.client("s3")
+    interface = S3Interface(max_workers=args.workers)
+    for label in args.sizes.split(","):
+        size = parse_size(label)
+        key = f"{args.prefix}/{label}.csv"
+        ensure_object(s3, args.bucket, key, size)
+        cases = {
+            "streaming, single GET": lambda key=key: sum(
+                len(chunk) for chunk in interface.iter_object_chunks(args.bucket, key, max_workers=1)
+            ),
+            f"streaming, {args.workers} range GETs": lambda key=key: sum(
+                len(chunk) for chunk in interface.iter_object_chunks(args.bucket, key)
+            ),
+            "lines, range GETs": lambda key=key: sum(
+                len(line) + 1 for line in interface.iter_object_lines(args.bucket, key, encoding=None)
+            ),
+            "memoryview": lambda key=key: len(interface.read_object_bytes(args.bucket, key)),
+        }
+        if size <= parse_size(args.max_text_size):
+
+            def text_case(key=key):
+                return len(interface.read_object(args.bucket, key).getvalue())
+
+            cases = {"read_object (StringIO)": text_case, **cases}
+        print(f"{label} object")
+        for name, case in cases.items():
+            read, elapsed = timed(case)
+            print(f"  {name:<26} {elapsed:8.2f} s  {read / elapsed / 1024**2:8.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
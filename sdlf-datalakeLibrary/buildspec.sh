@@ -13,11 +13,18 @@ MODULE="${module_name_alnum,,}"
 MODULE="DatalakeLibrary" # TODO
 
 mkdir artifacts
-zip -r artifacts/datalake_library.zip ./python -x \*__pycache__\*
+zip -r artifacts/datalake_library.zip ./python -x \*__pycache__\* -x ./python/datalake_library/tests/\*
 LAYER_HASH="$(sha256sum artifacts/datalake_library.zip | cut -c1-12)"
 aws s3api put-object --bucket "$ARTIFACTS_BUCKET" \
     --key "sdlf/layers/$MODULE-$LAYER_HASH.zip" \
     --body artifacts/datalake_library.zip
+# core layer for routing, redrive and error functions: data_quality (awswrangler, pandas) left out
+zip -r artifacts/datalake_library_core.zip ./python -x \*__pycache__\* -x ./python/datalake_library/tests/\* \
+    -x ./python/datalake_library/data_quality/\*
+CORE_LAYER_HASH="$(sha256sum artifacts/datalake_library_core.zip | cut -c1-12)"
+aws s3api put-object --bucket "$ARTIFACTS_BUCKET" \
+    --key "sdlf/layers/${MODULE}Core-$CORE_LAYER_HASH.zip" \
+    --body artifacts/datalake_library_core.zip
 
 STACK_NAME="sdlf-lambdalayers-$MODULE"
 aws cloudformation --endpoint-url "$CFN_ENDPOINT" deploy \
@@ -27,6 +34,7 @@ aws cloudformation --endpoint-url "$CFN_ENDPOINT" deploy \
         pArtifactsBucket="$ARTIFACTS_BUCKET" \
         pLayerName="$MODULE" \
         pGitRef="$LAYER_HASH" \
+        pCoreGitRef="$CORE_LAYER_HASH" \
     --tags Framework=sdlf \
     --capabilities "CAPABILITY_NAMED_IAM" "CAPABILITY_AUTO_EXPAND" || exit 1
 
@@ -0,0 +1,100 @@
+import gzip
+import hashlib
+import json
+import os
+
+from .clients import get_client
+from .commons import init_logger
+
+POINTER_KEY = "sdlf_claim_check"
+
+
+def _pointer(payload):
+    """Returns the claim check details of payload if it is a pointer, None otherwise"""
+    if isinstance(payload, str) and payload.startswith('{"' + POINTER_KEY + '"'):
+        payload = json.loads(payload)
+    if isinstance(payload, dict) and len(payload) == 1 and POINTER_KEY in payload:
+        return payload[POINTER_KEY]
+    return None
+
+
+def is_claim_check(payload):
+    return _pointer(payload) is not None
+
+
+def rehydrate(payload, s3_client=None):
+    """Returns the payload a claim check points to, or payload itself when it is not a claim check
+
+    :param payload: str or dict, as returned by ClaimCheck.offload or received from a queue or state machine
+    :param s3_client: s3 client to fetch the payload with, defaults to the shared client
+    """
+    pointer = _pointer(payload)
+    if pointer is None:
+        return payload
+    s3_client = s3_client or get_client("s3")
+    body = s3_client.get_object(Bucket=pointer["bucket"], Key=pointer["key"])["Body"].read()
+    if pointer.get("compression") == "gzip":
+        body = gzip.decompress(body)
+    body = body.decode("utf-8")
+    return body if pointer["format"] == "str" else json.loads(body)
+
+
+class ClaimCheck:
+    """Stores payloads too large for Step Functions inputs, SQS messages (256 KB) or DynamoDB items (400 KB) in S3
+    and passes a small pointer instead, which rehydrate() turns back into the payload.
+
+    Objects are named after the SHA-256 of their content: offloading the same payload twice gives the same pointer.
+    They are not deleted once consumed, a lifecycle rule on the prefix should expire them.
+    """
+
+    def __init__(self, bucket, prefix="claim-check", *, threshold=None, compress=True, log_level=None, s3_client=None):
+        """
+        :param bucket: bucket the payloads are stored in, normally the artifacts bucket
+        :param prefix: key prefix of the stored payloads
+        :param threshold: size in bytes above which payloads are offloaded, defaults to the SDLF_CLAIM_CHECK_THRESHOLD
+            env variable or 192 KB
+        :param compress: gzip the stored payloads. Payloads read by a Step Functions Map ItemReader must not be
+        """
+        self.log_level = log_level or os.getenv("LOG_LEVEL", "INFO")
+        self._logger = init_logger(__name__, self.log_level)
+        self._s3_client = s3_client or get_client("s3")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.threshold = threshold or int(os.getenv("SDLF_CLAIM_CHECK_THRESHOLD", str(192 * 1024)))
+        self.compress = compress
+
+    def offload(self, payload):
+        """Returns payload unchanged if its size is at most the threshold, a pointer to a stored copy otherwise
+
+        :param payload: str, or any object serialisable to JSON
+        :return: payload, or the pointer: JSON str for str payloads, dict otherwise
+        """
+        body = payload if isinstance(payload, str) else json.dumps(payload)
+        if len(body.encode("utf-8")) <= self.threshold:
+            return payload
+        return self.store(payload)
+
+    def store(self, payload):
+        """Stores payload in S3 whatever its size and returns the pointer: JSON str for str payloads, dict otherwise"""
+        is_str = isinstance(payload, str)
+        body = (payload if is_str else json.dumps(payload)).encode("utf-8")
+        key = f"{self.prefix}/{hashlib.sha256(body).hexdigest()}.json"
+        body_size = len(body)
+        if self.compress:
+            body = gzip.compress(body)
+            key += ".gz"
+        self._s3_client.put_object(Bucket=self.bucket, Key=key, Body=body)
+        self._logger.info(f"Offloaded {body_size} bytes payload to s3://{self.bucket}/{key} ({len(body)} bytes stored)")
+        pointer = {
+            POINTER_KEY: {
+                "bucket": self.bucket,
+                "key": key,
+                "size": body_size,
+                "compression": "gzip" if self.compress else None,
+                "format": "str" if is_str else "json",
+            }
+        }
+        return json.dumps(pointer) if is_str else pointer
+
+    def rehydrate(self, payload):
+        return rehydrate(payload, s3_client=self._s3_client)
@@ -0,0 +1,76 @@
+import os
+import threading
+
+import boto3
+from botocore.client import Config
+
+
+def regional_endpoint(service_name, region_name=None):
+    """Returns the regional endpoint of an AWS service, e.g. https://sqs.eu-west-1.amazonaws.com"""
+    return f"https://{service_name}.{region_name or os.getenv('AWS_REGION')}.amazonaws.com"
+
+
+class ClientRegistry:
+    """Lazily creates boto3 clients and hands out the same client for the same (service, region, endpoint, config).
+
+    boto3 clients are thread-safe, sharing them lets warm Lambda invocations and worker threads reuse
+    the same connection pools instead of paying client construction and TCP/TLS handshakes again.
+    """
+
+    def __init__(self, max_pool_connections=None):
+        """
+        :param max_pool_connections: size of the connection pool of each client, it should match the number of
+            threads using a client concurrently. Defaults to the SDLF_MAX_POOL_CONNECTIONS env variable or 10
+        """
+        self.max_pool_connections = max_pool_connections or int(os.getenv("SDLF_MAX_POOL_CONNECTIONS", "10"))
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _config(self, config=None):
+        default_config = Config(user_agent="awssdlf/2.11.0", max_pool_connections=self.max_pool_connections)
+        return default_config.merge(config) if config else default_config
+
+    @staticmethod
+    def _config_key(config):
+        return repr(sorted(config._user_provided_options.items()))
+
+    def client(self, service_name, region_name=None, endpoint_url=None, config=None):
+        """Returns the registry's client for service_name, creating it on first use
+
+        :param service_name: boto3 service name, e.g. s3
+        :param region_name: region of the client, defaults to the region of the default boto3 session
+        :param endpoint_url: endpoint of the client, defaults to the boto3 endpoint resolution
+        :param config: botocore Config merged over the registry defaults (user agent and pool size)
+        """
+        if boto3.DEFAULT_SESSION is None:
+            boto3.setup_default_session()
+        # keying on the session hands out new clients after boto3.setup_default_session() swapped credentials
+        session = boto3.DEFAULT_SESSION
+        client_config = self._config(config)
+        key = (id(session), service_name, region_name, endpoint_url, self._config_key(client_config))
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = session.client(
+                        service_name, region_name=region_name, endpoint_url=endpoint_url, config=client_config
+                    )
+                    self._clients[key] = client
+        return client
+
+    def set_max_pool_connections(self, max_pool_connections):
+        """Changes the pool size of the clients handed out from now on, e.g. to match a bigger thread pool"""
+        self.max_pool_connections = max_pool_connections
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+
+# Registry shared by all interfaces of the process
+clients = ClientRegistry()
+
+
+def get_client(service_name, region_name=None, endpoint_url=None, config=None):
+    return clients.client(service_name, region_name=region_name, endpoint_url=endpoint_url, config=config)
@@ -1,7 +1,11 @@
 import logging
-from typing import TYPE_CHECKING, Any, Dict, Mapping, Optional
+import random
+import threading
+import time
+from decimal import Decimal
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Mapping, Optional
 
-from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from boto3.dynamodb.types import DYNAMODB_CONTEXT, TypeDeserializer, TypeSerializer
 
 if TYPE_CHECKING:
     from mypy_boto3_dynamodb.type_defs import (
@@ -18,15 +22,153 @@ def init_logger(file_name, log_level=None):
     return logger
 
 
+class DynamoDBCodec:
+    """Converts items between Python and DynamoDB JSON.
+
+    The types SDLF actually stores (str, int, bool, Decimal, None, lists and maps of those) are handled inline,
+    everything else (sets, binary, ...) is delegated to boto3's TypeSerializer/TypeDeserializer so that the
+    behaviour, including the errors raised for unsupported values such as floats, stays identical to boto3's.
+    """
+
+    # DynamoDB numbers have up to 38 digits of precision, larger ints go through boto3 (and fail there)
+    _MAX_FAST_INT = 10**38
+
+    def __init__(self):
+        self._serializer = TypeSerializer()
+        self._deserializer = TypeDeserializer()
+        self._fast_serializers = {
+            str: lambda value: {"S": value},
+            bool: lambda value: {"BOOL": value},
+            int: self._serialize_int,
+            Decimal: self._serialize_decimal,
+            type(None): lambda value: {"NULL": True},
+            dict: lambda value: {"M": {k: self.serialize(v) for k, v in value.items()}},
+            list: lambda value: {"L": [self.serialize(v) for v in value]},
+        }
+        self._fast_deserializers = {
+            "S": lambda value: value,
+            "N": DYNAMODB_CONTEXT.create_decimal,
+            "BOOL": lambda value: value,
+            "NULL": lambda value: None,
+            "M": lambda value: {k: self.deserialize(v) for k, v in value.items()},
+            "L": lambda value: [self.deserialize(v) for v in value],
+        }
+
+    def _serialize_int(self, value: int) -> Optional["AttributeValueTypeDef"]:
+        if -self._MAX_FAST_INT < value < self._MAX_FAST_INT:
+            return {"N": str(value)}
+        return None
+
+    @staticmethod
+    def _serialize_decimal(value: Decimal) -> Optional["AttributeValueTypeDef"]:
+        if value.is_finite():
+            return {"N": str(DYNAMODB_CONTEXT.create_decimal(value))}
+        return None
+
+    def serialize(self, value: Any) -> "AttributeValueTypeDef":
+        fast_serializer = self._fast_serializers.get(type(value))
+        if fast_serializer:
+            serialized = fast_serializer(value)
+            if serialized is not None:
+                return serialized
+        return self._serializer.serialize(value)
+
+    def deserialize(self, value: "AttributeValueTypeDef") -> Any:
+        if len(value) == 1:
+            for dynamodb_type, dynamodb_value in value.items():
+                fast_deserializer = self._fast_deserializers.get(dynamodb_type)
+                if fast_deserializer:
+                    return fast_deserializer(dynamodb_value)
+        return self._deserializer.deserialize(value)
+
+    def serialize_item(self, item: Mapping[str, Any]) -> Dict[str, "AttributeValueTypeDef"]:
+        return {k: self.serialize(v) for k, v in item.items()}
+
+    def deserialize_item(self, item: Mapping[str, "AttributeValueTypeDef"]) -> Dict[str, Any]:
+        return {k: self.deserialize(v) for k, v in item.items()}
+
+    def serialize_many(self, items: Iterable[Mapping[str, Any]]) -> List[Dict[str, "AttributeValueTypeDef"]]:
+        """Serializes a page of items, e.g. before a batch_write_item call"""
+        serialize = self.serialize
+        return [{k: serialize(v) for k, v in item.items()} for item in items]
+
+    def deserialize_many(self, items: Iterable[Mapping[str, "AttributeValueTypeDef"]]) -> List[Dict[str, Any]]:
+        """Deserializes a page of items, e.g. the Items of a query or scan response"""
+        deserialize = self.deserialize
+        return [{k: deserialize(v) for k, v in item.items()} for item in items]
+
+
+# Codec shared by all interfaces of the process
+dynamodb_codec = DynamoDBCodec()
+
+
+# Error codes AWS services return when a request is throttled and should be retried after a backoff
+THROTTLING_ERROR_CODES = {
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "SlowDown",
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequestsException",
+}
+
+
+def backoff_delay(attempt, base=0.05, cap=5.0):
+    """Exponential backoff with full jitter: a random delay in seconds between 0 and min(cap, base * 2 ** attempt)"""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class TokenBucket:
+    """Client-side token bucket shared by the threads of a process, to stay within an API quota that AWS enforces as
+    a token bucket itself (e.g. Step Functions StartExecution). Tokens refill at rate per second up to capacity.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Blocks until tokens are available and takes them"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def empty(self):
+        """Drops the available tokens, e.g. after being throttled: the service bucket is empty, ours should be too"""
+        with self._lock:
+            self._tokens = 0
+            self._updated = time.monotonic()
+
+
 def serialize_dynamodb_item(
     item: Mapping[str, Any], serializer: Optional[TypeSerializer] = None
 ) -> Dict[str, "AttributeValueTypeDef"]:
-    serializer = serializer if serializer else TypeSerializer()
-    return {k: serializer.serialize(v) for k, v in item.items()}
+    if serializer:
+        return {k: serializer.serialize(v) for k, v in item.items()}
+    return dynamodb_codec.serialize_item(item)
 
 
 def deserialize_dynamodb_item(
     item: Mapping[str, "AttributeValueTypeDef"], deserializer: Optional[TypeDeserializer] = None
 ) -> Dict[str, Any]:
-    deserializer = deserializer if deserializer else TypeDeserializer()
-    return {k: deserializer.deserialize(v) for k, v in item.items()}
+    if deserializer:
+        return {k: deserializer.deserialize(v) for k, v in item.items()}
+    return dynamodb_codec.deserialize_item(item)
+
+
+def serialize_dynamodb_items(items: Iterable[Mapping[str, Any]]) -> List[Dict[str, "AttributeValueTypeDef"]]:
+    return dynamodb_codec.serialize_many(items)
+
+
+def deserialize_dynamodb_items(items: Iterable[Mapping[str, "AttributeValueTypeDef"]]) -> List[Dict[str, Any]]:
+    return dynamodb_codec.deserialize_many(items)
@@ -1,14 +1,18 @@
-import os
 from abc import ABC, abstractmethod
 
-import awswrangler as wr  # Ensure Lambda has an AWS Wrangler Layer configured
-import boto3
-
+from ..clients import get_client, regional_endpoint
 from ..commons import init_logger
 
 logger = init_logger(__name__)
 
 
+def _wrangler():
+    """Imports awswrangler (pandas, pyarrow) on first use only, it is slow to import and needs an AWS Wrangler Layer"""
+    import awswrangler  # noqa: PLC0415
+
+    return awswrangler
+
+
 class GlueSchemaValidator(ABC):
     """
     Abstract class to validate objects against Glue Table schemas.
@@ -23,11 +27,11 @@ class GlueSchemaValidator(ABC):
         """
         self.boto3_session = boto3_session
         # Reuse session or create a default one
-        glue_endpoint_url = "https://glue." + os.getenv("AWS_REGION") + ".amazonaws.com"
+        glue_endpoint_url = regional_endpoint("glue")
         self.glue_client = (
             boto3_session.client("glue", endpoint_url=glue_endpoint_url)
             if boto3_session
-            else boto3.client("glue", endpoint_url=glue_endpoint_url)
+            else get_client("glue", endpoint_url=glue_endpoint_url)
         )
 
     def _get_table_parameters(self, database_name, table_name):
@@ -120,7 +124,7 @@ class ParquetSchemaValidator(GlueSchemaValidator):
         Returns:  list of dicts of a form { 'Name': ..., 'Type': ...}
         """
         # Retrieve object metadata
-        s3_objects = wr.s3.describe_objects(
+        s3_objects = _wrangler().s3.describe_objects(
             path=keys if keys and len(keys) > 0 else prefix, boto3_session=self.boto3_session
         )
 
@@ -132,7 +136,7 @@ class ParquetSchemaValidator(GlueSchemaValidator):
         ]
 
         # Retrieve Parquet metadata
-        column_types, _ = wr.s3.read_parquet_metadata(
+        column_types, _ = _wrangler().s3.read_parquet_metadata(
             path=object_keys[0] if get_latest else object_keys, boto3_session=self.boto3_session
         )
 
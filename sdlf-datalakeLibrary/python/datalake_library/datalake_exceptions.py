@@ -4,6 +4,24 @@ class ObjectDeleteFailedException(Exception):
     pass
 
 
+class ObjectCopyFailedException(Exception):
+    """Raised when a bulk copy or move fails to copy some of the objects"""
+
+    pass
+
+
+class MessageSendFailedException(Exception):
+    """Raised when a batch send fails to send some of the messages"""
+
+    pass
+
+
+class ExecutionStartFailedException(Exception):
+    """Raised when a bulk start fails to start some of the state machine executions"""
+
+    pass
+
+
 class InvalidS3PutEventException(Exception):
     """Raised when the object added to the bucket according to the provided event does not match the expected pattern"""
 
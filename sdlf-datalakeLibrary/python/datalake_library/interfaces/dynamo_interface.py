@@ -1,16 +1,27 @@
 import datetime as dt
+import itertools
 import logging
 import os
+import threading
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from types import TracebackType
-from typing import TYPE_CHECKING, Any, Dict, List, Optional, Type
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Optional, Type
 
-import boto3
-from boto3.dynamodb.conditions import Attr, Key
-from boto3.dynamodb.types import TypeSerializer
-from botocore.client import Config
+from boto3.dynamodb.conditions import Attr, ConditionExpressionBuilder, Key
 from botocore.exceptions import ClientError
 
-from ..commons import deserialize_dynamodb_item, init_logger, serialize_dynamodb_item
+from ..clients import get_client
+from ..commons import (
+    THROTTLING_ERROR_CODES,
+    backoff_delay,
+    deserialize_dynamodb_item,
+    deserialize_dynamodb_items,
+    init_logger,
+    serialize_dynamodb_item,
+    serialize_dynamodb_items,
+)
+from ..datalake_exceptions import UnprocessedKeysException
 
 if TYPE_CHECKING:
     from mypy_boto3_dynamodb.client import DynamoDBClient
@@ -22,12 +33,18 @@ if TYPE_CHECKING:
 logger = logging.getLogger(__name__)
 
 
+class QueryPage(NamedTuple):
+    """Items of one Query call, last_evaluated_key is the token to resume the query from, None on the last page"""
+
+    items: List[Dict[str, Any]]
+    last_evaluated_key: Optional[Dict[str, Any]]
+
+
 class DynamoInterface:
     def __init__(self, configuration, log_level=None, dynamodb_client=None):
         self.log_level = log_level or os.getenv("LOG_LEVEL", "INFO")
         self._logger = init_logger(__name__, self.log_level)
-        session_config = Config(user_agent="awssdlf/2.11.0")
-        self.dynamodb_client = dynamodb_client or boto3.client("dynamodb", config=session_config)
+        self.dynamodb_client = dynamodb_client or get_client("dynamodb")
 
         self._config = configuration
 
@@ -59,11 +76,10 @@ class DynamoInterface:
 
     def get_item(self, table, key):
         try:
-            serializer = TypeSerializer()
             item = deserialize_dynamodb_item(
-                self.dynamodb_client.get_item(
-                    TableName=table, Key=serialize_dynamodb_item(key, serializer), ConsistentRead=True
-                )["Item"]
+                self.dynamodb_client.get_item(TableName=table, Key=serialize_dynamodb_item(key), ConsistentRead=True)[
+                    "Item"
+                ]
             )
         except ClientError:
             msg = "Error getting item from {} table".format(table)
@@ -71,10 +87,85 @@ class DynamoInterface:
             raise
         return item
 
+    def batch_get_items(self, table, keys, projection=None, consistent=False, max_workers=None):
+        """Generator of the items of table matching keys, fetched with parallel 100-key BatchGetItem requests
+
+        Items are yielded as the requests complete, not in the order of keys, and keys without an item are skipped.
+        :param table: name of the DynamoDB table
+        :param keys: iterable of primary keys, e.g. [{"id": "s3://bucket/key"}], duplicates are only fetched once
+        :param projection: optional list of attribute names to return, the primary key should be part of it to
+            match items with keys
+        :param consistent: strongly consistent reads, twice the read capacity of the default eventual consistency
+        :param max_workers: number of concurrent requests, defaults to the SDLF_BATCH_GET_WORKERS env variable or 8
+        """
+        max_workers = max_workers or int(os.getenv("SDLF_BATCH_GET_WORKERS", "8"))
+        request = {"ConsistentRead": consistent}
+        if projection:
+            request["ProjectionExpression"] = ", ".join(f"#p{i}" for i in range(len(projection)))
+            request["ExpressionAttributeNames"] = {f"#p{i}": attribute for i, attribute in enumerate(projection)}
+
+        # BatchGetItem rejects requests with duplicate keys
+        unique_keys = {}
+        for key in keys:
+            serialized_key = serialize_dynamodb_item(key)
+            unique_keys.setdefault(self._key_signature(serialized_key), serialized_key)
+        unique_keys = iter(unique_keys.values())
+        chunks = iter(lambda: list(itertools.islice(unique_keys, 100)), [])
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # at most max_workers chunks in flight to keep memory flat for large key sets
+            futures = {
+                executor.submit(self._batch_get_chunk, table, chunk, request)
+                for chunk in itertools.islice(chunks, max_workers)
+            }
+            try:
+                while futures:
+                    done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from deserialize_dynamodb_items(future.result())
+                        chunk = next(chunks, None)
+                        if chunk is not None:
+                            futures.add(executor.submit(self._batch_get_chunk, table, chunk, request))
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def _batch_get_chunk(self, table, keys, request, max_retries=8):
+        items = []
+        attempt = 0
+        while True:
+            try:
+                response = self.dynamodb_client.batch_get_item(RequestItems={table: {"Keys": keys, **request}})
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in THROTTLING_ERROR_CODES or attempt >= max_retries:
+                    msg = "Error getting items from {} table".format(table)
+                    self._logger.exception(msg)
+                    raise
+            else:
+                items.extend(response["Responses"].get(table, []))
+                keys = response.get("UnprocessedKeys", {}).get(table, {}).get("Keys", [])
+                if not keys:
+                    return items
+                if attempt >= max_retries:
+                    raise UnprocessedKeysException(
+                        f"{len(keys)} keys of {table} still unprocessed after {max_retries} retries"
+                    )
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    @staticmethod
+    def _key_signature(serialized_key):
+        return tuple(sorted((name, tuple(sorted(value.items()))) for name, value in serialized_key.items()))
+
+    def batch_get_object_metadata(self, bucket, keys, projection=None):
+        """Generator of the object metadata catalog items of the S3 keys of bucket"""
+        return self.batch_get_items(
+            self.object_metadata_table, [{"id": self.build_id(bucket, key)} for key in keys], projection=projection
+        )
+
     def put_item(self, table, item):
         try:
-            serializer = TypeSerializer()
-            self.dynamodb_client.put_item(TableName=table, Item=serialize_dynamodb_item(item, serializer))
+            self.dynamodb_client.put_item(TableName=table, Item=serialize_dynamodb_item(item))
         except ClientError:
             msg = "Error putting item {} into {} table".format(item, table)
             self._logger.exception(msg)
@@ -96,20 +187,19 @@ class DynamoInterface:
         return self.batch_put_item_in_object_metadata_table(items)
 
     def batch_put_item_in_object_metadata_table(self, items):
-        serializer = TypeSerializer()
-        with _TableBatchWriter(self.object_metadata_table, self.dynamodb_client) as writer:
-            for item in items:
-                writer.put_item(serialize_dynamodb_item(item, serializer))
+        with _TableBatchWriter(self.object_metadata_table, self.dynamodb_client, overwrite_by_pkeys=["id"]) as writer:
+            for item in serialize_dynamodb_items(items):
+                writer.put_item(item)
+        return writer.stats
 
     def update_object(self, bucket, key, update_expr, expr_names, expr_values):
         try:
-            serializer = TypeSerializer()
             self.dynamodb_client.update_item(
                 TableName=self.object_metadata_table,
                 Key={"id": {"S": self.build_id(bucket, key)}},
                 UpdateExpression=update_expr,
                 ExpressionAttributeNames=expr_names,
-                ExpressionAttributeValues=serialize_dynamodb_item(expr_values, serializer),
+                ExpressionAttributeValues=serialize_dynamodb_item(expr_values),
                 ReturnValues="UPDATED_NEW",
             )
         except ClientError:
@@ -129,35 +219,91 @@ class DynamoInterface:
             self._logger.exception(msg)
             raise
 
+    def query_pages(
+        self,
+        table,
+        key_condition,
+        *,
+        index=None,
+        filter_condition=None,
+        projection=None,
+        page_size=None,
+        max_items=None,
+        exclusive_start_key=None,
+    ):
+        """Generator of QueryPage, one per Query call, items are deserialized but never accumulated
+
+        :param table: name of the DynamoDB table
+        :param key_condition: boto3.dynamodb.conditions Key condition, e.g. Key("dataset").eq("persons")
+        :param index: optional name of the index to query
+        :param filter_condition: optional boto3.dynamodb.conditions Attr condition applied by DynamoDB
+        :param projection: optional list of attribute names to return
+        :param page_size: maximum number of items DynamoDB evaluates per call (Limit)
+        :param max_items: stop once that many items were returned, the Limit of the last call is lowered to match
+        :param exclusive_start_key: last_evaluated_key of a previous page, to resume a query
+        """
+        request = {"TableName": table}
+        if index:
+            request["IndexName"] = index
+        builder = ConditionExpressionBuilder()
+        names, values = {}, {}
+        key_expression = builder.build_expression(key_condition, is_key_condition=True)
+        request["KeyConditionExpression"] = key_expression.condition_expression
+        names.update(key_expression.attribute_name_placeholders)
+        values.update(key_expression.attribute_value_placeholders)
+        if filter_condition is not None:
+            filter_expression = builder.build_expression(filter_condition)
+            request["FilterExpression"] = filter_expression.condition_expression
+            names.update(filter_expression.attribute_name_placeholders)
+            values.update(filter_expression.attribute_value_placeholders)
+        if projection:
+            request["ProjectionExpression"] = ", ".join(f"#p{i}" for i in range(len(projection)))
+            names.update({f"#p{i}": attribute for i, attribute in enumerate(projection)})
+        request["ExpressionAttributeNames"] = names
+        if values:
+            request["ExpressionAttributeValues"] = serialize_dynamodb_item(values)
+
+        remaining = max_items
+        last_evaluated_key = exclusive_start_key
+        while remaining is None or remaining > 0:
+            limit = min(filter(None, (page_size, remaining)), default=None)
+            if limit:
+                request["Limit"] = limit
+            if last_evaluated_key:
+                request["ExclusiveStartKey"] = last_evaluated_key
+            try:
+                response = self.dynamodb_client.query(**request)
+            except ClientError:
+                msg = "Error querying {} {}".format(table, f"{index} index" if index else "table")
+                self._logger.exception(msg)
+                raise
+            items = deserialize_dynamodb_items(response["Items"])
+            last_evaluated_key = response.get("LastEvaluatedKey")
+            if remaining is not None:
+                remaining -= len(items)
+            yield QueryPage(items, last_evaluated_key)
+            if not last_evaluated_key:
+                break
+
+    def query_items(self, table, key_condition, **kwargs):
+        """Generator of the items of query_pages, same arguments"""
+        for page in self.query_pages(table, key_condition, **kwargs):
+            yield from page.items
+
+    def iter_object_metadata_index(self, index, key_condition, **kwargs):
+        """Generator of QueryPage of an object metadata catalog index, same keyword arguments as query_pages"""
+        return self.query_pages(self.object_metadata_table, key_condition, index=index, **kwargs)
+
     def query_object_metadata_index(self, index, key_expression, key_value, filter_expression, filter_value, max_items):
-        try:
-            items = []
-            response = self.dynamodb_client.query(
-                TableName=self.object_metadata_table,
-                IndexName=index,
-                KeyConditionExpression=Key(key_expression).eq(key_value),
-                FilterExpression=Attr(filter_expression).eq(filter_value),
+        return list(
+            self.query_items(
+                self.object_metadata_table,
+                Key(key_expression).eq(key_value),
+                index=index,
+                filter_condition=Attr(filter_expression).eq(filter_value),
+                max_items=max_items,
             )
-            if response["Items"]:
-                items.extend([deserialize_dynamodb_item(item) for item in response["Items"]])
-            while "LastEvaluatedKey" in response:
-                response = self.dynamodb_client.query(
-                    TableName=self.object_metadata_table,
-                    IndexName=index,
-                    KeyConditionExpression=Key(key_expression).eq(key_value),
-                    FilterExpression=Attr(filter_expression).eq(filter_value),
-                    ExclusiveStartKey=response["LastEvaluatedKey"],
-                )
-                if response["Items"]:
-                    items.extend([deserialize_dynamodb_item(item) for item in response["Items"]])
-                if len(items) > max_items:
-                    items = items[:max_items]
-                    break
-        except ClientError:
-            msg = "Error querying object metadata {} index".format(index)
-            self._logger.exception(msg)
-            raise
-        return items
+        )
 
     def put_item_in_manifests_control_table(self, item):
         return self.put_item(self.manifests_control_table, item)
@@ -168,13 +314,12 @@ class DynamoInterface:
         )
 
     def update_manifests_control_table(self, key, update_expr, expr_names, expr_values):
-        serializer = TypeSerializer()
         return self.dynamodb_client.update_item(
             TableName=self.manifests_control_table,
             Key=key,
             UpdateExpression=update_expr,
             ExpressionAttributeNames=expr_names,
-            ExpressionAttributeValues=serialize_dynamodb_item(expr_values, serializer),
+            ExpressionAttributeValues=serialize_dynamodb_item(expr_values),
             ReturnValues="UPDATED_NEW",
         )
 
@@ -337,8 +482,41 @@ class DynamoInterface:
                         batch.delete_item(Key={pk_name: item[pk_name], sk_name: item[sk_name]})
 
 
+class BatchWriteStats:
+    """Throughput counters of a _TableBatchWriter"""
+
+    def __init__(self):
+        self.items_written = 0
+        self.batches = 0
+        self.retries = 0
+        self.throttles = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items_written=0, batches=0, retries=0, throttles=0):
+        with self._lock:
+            self.items_written += items_written
+            self.batches += batches
+            self.retries += retries
+            self.throttles += throttles
+
+    @property
+    def items_per_second(self):
+        return self.items_written / self.elapsed if self.elapsed else 0.0
+
+    def __repr__(self):
+        return (
+            f"BatchWriteStats(items_written={self.items_written}, batches={self.batches}, retries={self.retries}, "
+            f"throttles={self.throttles}, elapsed={self.elapsed:.3f}s, items_per_second={self.items_per_second:.1f})"
+        )
+
+
 class _TableBatchWriter:
-    """Automatically handle batch writes to DynamoDB for a single table."""
+    """Automatically handle batch writes to DynamoDB for a single table.
+
+    Batches of flush_amount requests are sent concurrently on a bounded thread pool, unprocessed items and
+    throttled calls are retried with exponential backoff and jitter.
+    """
 
     def __init__(
         self,
@@ -347,14 +525,28 @@ class _TableBatchWriter:
         flush_amount: int = 25,
         overwrite_by_pkeys: Optional[List[str]] = None,
         log_level=None,
+        *,
+        max_workers: Optional[int] = None,
+        max_retries: int = 8,
     ):
         self.log_level = log_level or os.getenv("LOG_LEVEL", "INFO")
         self._logger = init_logger(__name__, self.log_level)
         self._table_name = table_name
         self._client = client
-        self._items_buffer: List["WriteRequestTypeDef"] = []
+        # Requests keyed by their primary key values when overwrite_by_pkeys is set (a later request replaces an
+        # earlier one in O(1)), by a sequence number otherwise. dicts keep insertion order.
+        self._items_buffer: Dict[Any, "WriteRequestTypeDef"] = {}
+        self._sequence = itertools.count()
         self._flush_amount = flush_amount
         self._overwrite_by_pkeys = overwrite_by_pkeys
+        self._max_workers = max_workers or int(os.getenv("SDLF_BATCH_WRITE_WORKERS", "8"))
+        self._max_retries = max_retries
+        self._executor = None
+        self._futures = set()
+        # keys of the requests being sent, a request for the same key waits for them to preserve write order
+        self._in_flight: Dict[Any, Future] = {}
+        self.stats = BatchWriteStats()
+        self._start = time.perf_counter()
 
     def put_item(self, item: Dict[str, "AttributeValueTypeDef"]) -> None:
         """
@@ -380,51 +572,79 @@ class _TableBatchWriter:
 
     def _add_request_and_process(self, request: "WriteRequestTypeDef") -> None:
         if self._overwrite_by_pkeys:
-            self._remove_dup_pkeys_request_if_any(request, self._overwrite_by_pkeys)
-        self._items_buffer.append(request)
+            buffer_key = self._extract_pkey_values(request, self._overwrite_by_pkeys)
+            if self._items_buffer.pop(buffer_key, None) is not None:
+                self._logger.debug("With overwrite_by_pkeys enabled, skipping previous request for %s", buffer_key)
+        else:
+            buffer_key = next(self._sequence)
+        self._items_buffer[buffer_key] = request
         self._flush_if_needed()
 
-    def _remove_dup_pkeys_request_if_any(self, request: "WriteRequestTypeDef", overwrite_by_pkeys: List[str]) -> None:
-        pkey_values_new = self._extract_pkey_values(request, overwrite_by_pkeys)
-        for item in self._items_buffer:
-            if self._extract_pkey_values(item, overwrite_by_pkeys) == pkey_values_new:
-                self._items_buffer.remove(item)
-                self._logger.debug(
-                    "With overwrite_by_pkeys enabled, skipping request:%s",
-                    item,
-                )
-
-    def _extract_pkey_values(
-        self, request: "WriteRequestTypeDef", overwrite_by_pkeys: List[str]
-    ) -> Optional[List[Any]]:
+    def _extract_pkey_values(self, request: "WriteRequestTypeDef", overwrite_by_pkeys: List[str]) -> Optional[tuple]:
         if request.get("PutRequest"):
-            return [request["PutRequest"]["Item"][key] for key in overwrite_by_pkeys]
+            attributes = request["PutRequest"]["Item"]
         elif request.get("DeleteRequest"):
-            return [request["DeleteRequest"]["Key"][key] for key in overwrite_by_pkeys]
-        return None
+            attributes = request["DeleteRequest"]["Key"]
+        else:
+            return None
+        # attribute values are dicts such as {"S": "..."}, turned into tuples to be hashable
+        return tuple(tuple(sorted(attributes[key].items())) for key in overwrite_by_pkeys)
 
     def _flush_if_needed(self) -> None:
         if len(self._items_buffer) >= self._flush_amount:
             self._flush()
 
     def _flush(self) -> None:
-        items_to_send = self._items_buffer[: self._flush_amount]
-        self._items_buffer = self._items_buffer[self._flush_amount :]
-        response = self._client.batch_write_item(RequestItems={self._table_name: items_to_send})
-
-        unprocessed_items = response["UnprocessedItems"]
-        if not unprocessed_items:
-            unprocessed_items = {}
-        item_list = unprocessed_items.get(self._table_name, [])
-
-        # Any unprocessed_items are immediately added to the
-        # next batch we send.
-        self._items_buffer.extend(item_list)
-        self._logger.debug(
-            "Batch write sent %s, unprocessed: %s",
-            len(items_to_send),
-            len(self._items_buffer),
-        )
+        batch_keys = list(itertools.islice(self._items_buffer, self._flush_amount))
+        items_to_send = [self._items_buffer.pop(key) for key in batch_keys]
+        if self._overwrite_by_pkeys:
+            pending = {self._in_flight[key] for key in batch_keys if key in self._in_flight}
+            if pending:
+                self._wait(pending)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        # bound the number of batches held in memory, waiting for the oldest ones to complete
+        if len(self._futures) >= self._max_workers * 2:
+            self._wait(self._futures, return_when=FIRST_COMPLETED)
+        future = self._executor.submit(self._send_batch, items_to_send)
+        self._futures.add(future)
+        if self._overwrite_by_pkeys:
+            for key in batch_keys:
+                self._in_flight[key] = future
+
+    def _wait(self, futures, return_when=ALL_COMPLETED) -> None:
+        done, _ = wait(futures, return_when=return_when)
+        self._futures -= done
+        if self._overwrite_by_pkeys:
+            self._in_flight = {key: future for key, future in self._in_flight.items() if future not in done}
+        for future in done:
+            future.result()
+
+    def _send_batch(self, items_to_send: List["WriteRequestTypeDef"]) -> None:
+        attempt = 0
+        while True:
+            try:
+                response = self._client.batch_write_item(RequestItems={self._table_name: items_to_send})
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in THROTTLING_ERROR_CODES or attempt >= self._max_retries:
+                    raise
+                self.stats.add(throttles=1, retries=1)
+            else:
+                self.stats.add(batches=1)
+                unprocessed_items = (response.get("UnprocessedItems") or {}).get(self._table_name, [])
+                self.stats.add(items_written=len(items_to_send) - len(unprocessed_items))
+                if not unprocessed_items:
+                    return
+                if attempt >= self._max_retries:
+                    raise UnprocessedKeysException(
+                        f"{len(unprocessed_items)} items of {self._table_name} still unprocessed "
+                        f"after {self._max_retries} retries"
+                    )
+                self._logger.debug("Batch write sent %s, unprocessed: %s", len(items_to_send), len(unprocessed_items))
+                self.stats.add(retries=1)
+                items_to_send = unprocessed_items
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
 
     def __enter__(self) -> "_TableBatchWriter":
         return self
@@ -436,8 +656,25 @@ class _TableBatchWriter:
         traceback: Optional[TracebackType],
     ) -> Optional[bool]:
         # When we exit, we need to keep flushing whatever's left
-        # until there's nothing left in our items buffer.
-        while self._items_buffer:
-            self._flush()
+        # until there's nothing left in our items buffer, even if the block raised (as boto3's BatchWriter does)
+        try:
+            while self._items_buffer:
+                self._flush()
+            if self._futures:
+                self._wait(self._futures)
+        except Exception:
+            if exception_type is None:
+                raise
+            # don't mask the exception that interrupted the block
+            self._logger.exception(
+                f"Error flushing batch writes to {self._table_name}: {self.stats.items_written} items written, "
+                f"{len(self._items_buffer)} left unsent besides the failed batch"
+            )
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            self.stats.elapsed = time.perf_counter() - self._start
+            self._logger.info(f"Batch write to {self._table_name}: {self.stats}")
 
         return None
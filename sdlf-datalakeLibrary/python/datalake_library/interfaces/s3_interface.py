@@ -1,48 +1,382 @@
+import codecs
+import hashlib
+import io
+import itertools
 import json
+import math
 import os
+import queue
 import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime
 from io import StringIO
+from typing import NamedTuple
 from urllib.parse import unquote_plus
 
-import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.client import Config
 from botocore.exceptions import ClientError
 
-from ..commons import init_logger
-from ..datalake_exceptions import ObjectDeleteFailedException
+from ..clients import clients, get_client
+from ..commons import THROTTLING_ERROR_CODES, backoff_delay, init_logger
+from ..datalake_exceptions import ObjectCopyFailedException, ObjectDeleteFailedException
+
+MB = 1024**2
+
+
+class ObjectMetadata(NamedTuple):
+    key: str
+    size: int
+    last_modified: datetime
+    etag: str
+
+
+class DeleteSummary:
+    """Outcome of a bulk delete: number of deleted keys, errors of the keys still failing after retries"""
+
+    def __init__(self):
+        self.deleted = 0
+        self.failed = []
+        self.elapsed = 0.0
+
+    def add(self, *results):
+        for deleted, errors in results:
+            self.deleted += deleted
+            self.failed.extend(errors)
+
+    def __repr__(self):
+        return f"DeleteSummary(deleted={self.deleted}, failed={len(self.failed)}, elapsed={self.elapsed:.3f}s)"
+
+
+class CopySummary:
+    """Outcome of a bulk copy: copied objects and bytes (of the objects whose size was known), objects skipped as
+    already copied, errors"""
+
+    def __init__(self):
+        self.copied = 0
+        self.copied_bytes = 0
+        self.skipped = 0
+        self.failed = []
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        return (
+            f"CopySummary(copied={self.copied}, copied_bytes={self.copied_bytes}, skipped={self.skipped}, "
+            f"failed={len(self.failed)}, elapsed={self.elapsed:.3f}s)"
+        )
+
+
+class _ChunkReader(io.RawIOBase):
+    """Read-only binary file over an iterable of bytes (or str, utf-8 encoded) chunks, or over a file-like"""
+
+    def __init__(self, chunks):
+        if hasattr(chunks, "read"):
+            file_object = chunks
+            chunks = iter(lambda: file_object.read(MB), file_object.read(0))
+        self._chunks = iter(chunks)
+        self._pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._pending = chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+        length = min(len(buffer), len(self._pending))
+        buffer[:length] = self._pending[:length]
+        self._pending = self._pending[length:]
+        return length
+
+
+class _CacheEntry:
+    __slots__ = ("etag", "path", "size", "pins")
+
+    def __init__(self, etag, path, size):
+        self.etag = etag
+        self.path = path
+        self.size = size
+        # number of get blocks using the file
+        self.pins = 0
+
+    def in_use(self):
+        return self.pins > 0
+
+
+class ObjectCache:
+    """LRU cache of S3 objects downloaded to local storage, bounded by bytes and validated by ETag
+
+    Each version of an object is downloaded to its own directory, a file handed out is never overwritten. Warm Lambda
+    invocations reuse files still matching the object's ETag after a conditional GET (If-None-Match), which costs a
+    round trip but no transfer. Files in use are not evicted: the cache can exceed max_bytes until they are released.
+    """
+
+    # cache shared by the S3 interfaces of the process, created on first use
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, directory=None, max_bytes=None, log_level=None):
+        """
+        :param directory: local directory of the cache, defaults to /tmp/sdlf-object-cache
+        :param max_bytes: size limit of the cached objects, defaults to the SDLF_OBJECT_CACHE_MAX_BYTES env variable
+            or 256 MB, to stay within Lambda ephemeral storage
+        """
+        self.log_level = log_level or os.getenv("LOG_LEVEL", "INFO")
+        self._logger = init_logger(__name__, self.log_level)
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "sdlf-object-cache")
+        self.max_bytes = max_bytes or int(os.getenv("SDLF_OBJECT_CACHE_MAX_BYTES", str(256 * MB)))
+        # (bucket, key) -> _CacheEntry, least recently used first
+        self._entries = OrderedDict()
+        # previous versions of objects replaced while still in use
+        self._retired = []
+        self._size = 0
+        self._lock = threading.Lock()
+        # (bucket, key) -> [lock, number of threads using it] of the objects being fetched
+        self._key_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_downloaded = 0
+        # files left by a previous process are not tracked, start from an empty directory
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    @classmethod
+    def shared(cls):
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    @contextmanager
+    def _key_lock(self, cache_key):
+        with self._lock:
+            key_lock = self._key_locks.setdefault(cache_key, [threading.Lock(), 0])
+            key_lock[1] += 1
+        try:
+            with key_lock[0]:
+                yield
+        finally:
+            with self._lock:
+                key_lock[1] -= 1
+                if not key_lock[1]:
+                    del self._key_locks[cache_key]
+
+    @contextmanager
+    def get(self, s3_client, bucket, key):
+        """Context manager of the local path of the object, downloaded unless the cached copy still matches its ETag
+
+        The file must be treated as read-only, other threads and later invocations may be handed the same path.
+        It is not evicted until the block exits.
+        """
+        entry = self._checkout(s3_client, bucket, key)
+        try:
+            yield entry.path
+        finally:
+            with self._lock:
+                entry.pins -= 1
+                self._evict()
+
+    def _checkout(self, s3_client, bucket, key):
+        cache_key = (bucket, key)
+        # one download per object at a time, different objects are downloaded concurrently
+        with self._key_lock(cache_key):
+            with self._lock:
+                entry = self._entries.get(cache_key)
+            request = {"Bucket": bucket, "Key": key}
+            if entry:
+                request["IfNoneMatch"] = entry.etag
+            try:
+                response = s3_client.get_object(**request)
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in ("304", "NotModified"):
+                    raise
+                with self._lock:
+                    # another thread may have evicted the entry since it was read
+                    if self._entries.get(cache_key) is entry:
+                        self.hits += 1
+                        self._entries.move_to_end(cache_key)
+                        entry.pins += 1
+                        self._logger.info("Object cache hit: {}/{}".format(bucket, key))
+                        return entry
+                response = s3_client.get_object(Bucket=bucket, Key=key)
+
+            path = self._store(bucket, key, response)
+            entry = _CacheEntry(response["ETag"], path, os.path.getsize(path))
+            entry.pins += 1
+            with self._lock:
+                self.misses += 1
+                self.bytes_downloaded += entry.size
+                self._add(cache_key, entry)
+            self._logger.info("Object cache miss: {}/{}".format(bucket, key))
+            return entry
+
+    def _store(self, bucket, key, response):
+        name = hashlib.sha256(f"{bucket}/{key}/{response['ETag']}".encode()).hexdigest()[:32]
+        entry_dir = os.path.join(self.directory, name)
+        os.makedirs(entry_dir, exist_ok=True)
+        path = os.path.join(entry_dir, key.split("/")[-1] or "object")
+        # written under a unique name and renamed, readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=entry_dir, prefix=".download-")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                for chunk in response["Body"].iter_chunks(MB):
+                    temp_file.write(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return path
+
+    def _add(self, cache_key, entry):
+        previous = self._entries.pop(cache_key, None)
+        if previous and previous.path != entry.path:
+            self._retired.append(previous)
+        elif previous:
+            self._size -= previous.size
+        self._entries[cache_key] = entry
+        self._size += entry.size
+        self._evict()
+
+    def _evict(self):
+        for entry in [entry for entry in self._retired if not entry.in_use()]:
+            self._retired.remove(entry)
+            self._remove(entry)
+        for cache_key, entry in list(self._entries.items()):
+            if self._size <= self.max_bytes:
+                break
+            if not entry.in_use():
+                del self._entries[cache_key]
+                self._remove(entry)
+                self.evictions += 1
+
+    def _remove(self, entry):
+        self._size -= entry.size
+        # the whole directory, with the files a caller may have written next to the object
+        shutil.rmtree(os.path.dirname(entry.path), ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes_downloaded": self.bytes_downloaded,
+                "cached_objects": len(self._entries),
+                "cached_bytes": self._size,
+            }
+
+    def clear(self):
+        with self._lock:
+            for entry in [*self._entries.values(), *self._retired]:
+                self._remove(entry)
+            self._entries.clear()
+            self._retired.clear()
 
 
 class S3Interface:
-    def __init__(self, log_level=None, s3_client=None):
+    # size of the byte ranges fetched by streaming reads
+    read_part_size = 8 * MB
+    # S3 limits of multipart uploads
+    min_part_size = 5 * MB
+    max_parts = 10000
+    # S3 limit of keys per DeleteObjects call
+    max_delete_keys = 1000
+    # per-key errors of batch operations worth retrying
+    retryable_error_codes = THROTTLING_ERROR_CODES | {"InternalError", "OperationAborted", "ServiceUnavailable"}
+
+    def __init__(self, log_level=None, s3_client=None, max_workers=None, part_size=None):
+        """
+        :param max_workers: number of concurrent requests of parallel transfers, defaults to the SDLF_S3_WORKERS
+            env variable or 8
+        :param part_size: part size in bytes of multipart transfers, defaults to the SDLF_S3_PART_SIZE_MB env
+            variable or to a size derived from the size of each object
+        """
         self.log_level = log_level or os.getenv("LOG_LEVEL", "INFO")
         self._logger = init_logger(__name__, self.log_level)
-        self._session_config = Config(user_agent="awssdlf/2.11.0")
-        self._s3_client = s3_client or boto3.client("s3", config=self._session_config)
+        self.max_workers = max_workers or int(os.getenv("SDLF_S3_WORKERS", "8"))
+        part_size_mb = os.getenv("SDLF_S3_PART_SIZE_MB")
+        self.part_size = part_size or (int(part_size_mb) * MB if part_size_mb else None)
+        if s3_client is None and self.max_workers > clients.max_pool_connections:
+            s3_client = get_client("s3", config=Config(max_pool_connections=self.max_workers))
+        self._s3_client = s3_client or get_client("s3")
+
+    def transfer_config(self, size=None):
+        """TransferConfig of multipart transfers, tuned from the object size and the memory of the Lambda function
+
+        Parts are at least 8 MB, and bigger for objects over 8 GB to keep uploads within 1000 parts (the S3 limit
+        is 10000). Concurrency is max_workers, lowered so that the parts in flight use at most a quarter of the
+        memory of the function (AWS_LAMBDA_FUNCTION_MEMORY_SIZE) and there are no more workers than parts.
+        """
+        part_size = self.part_size
+        if not part_size:
+            part_size = max(self.read_part_size, math.ceil((size or 0) / 1000 / MB) * MB)
+        if size:
+            part_size = max(part_size, self.min_part_size, math.ceil(size / self.max_parts / MB) * MB)
+        concurrency = self.max_workers
+        memory_size = os.getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE")
+        if memory_size:
+            concurrency = min(concurrency, int(memory_size) * MB // 4 // part_size)
+        if size:
+            concurrency = min(concurrency, math.ceil(size / part_size))
+        return TransferConfig(
+            multipart_threshold=part_size, multipart_chunksize=part_size, max_concurrency=max(1, concurrency)
+        )
 
     def download_object(self, bucket, key):
-        dir_path = f"/tmp/{bucket}/"
-        if os.path.exists(dir_path):
-            # aws lambda does not always clean up /tmp between executions
-            shutil.rmtree(dir_path, ignore_errors=True)
-        os.makedirs(dir_path)
-        self._logger.info("Downloading object: {}/{}".format(bucket, key))
-        object_path = dir_path + key.split("/")[-1]
+        """Downloads an object to /tmp/<bucket>/ and returns its local path
+
+        The directory is emptied first, the file of the previous download_object call on the bucket is replaced.
+        cached_object keeps objects across calls instead.
+        """
         key = unquote_plus(key)
+        self._logger.info("Downloading object: {}/{}".format(bucket, key))
         try:
-            self._s3_client.download_file(bucket, key, object_path)
+            dir_path = os.path.join(tempfile.gettempdir(), bucket)
+            # aws lambda does not always clean up /tmp between executions
+            shutil.rmtree(dir_path, ignore_errors=True)
+            os.makedirs(dir_path)
+            object_path = os.path.join(dir_path, key.split("/")[-1])
+            self._s3_client.download_file(bucket, key, object_path, Config=self.transfer_config())
         except ClientError:
             msg = "Error downloading object: {}/{}".format(bucket, key)
             self._logger.exception(msg)
             raise
         return object_path
 
+    def cached_object(self, bucket, key):
+        """Context manager of the local path of an object kept in the process-wide ObjectCache
+
+        The object is only downloaded again when its ETag changed. The file must not be modified, and is protected
+        from eviction until the block exits.
+
+        with s3_interface.cached_object(bucket, key) as local_path:
+            ...
+        """
+        key = unquote_plus(key)
+        self._logger.info("Downloading object: {}/{}".format(bucket, key))
+        return ObjectCache.shared().get(self._s3_client, bucket, key)
+
     def upload_object(self, object_path, bucket, key, kms_key=None):
         self._logger.info("Uploading object: {}".format(object_path))
         try:
             extra_kwargs = {}
             if kms_key:
                 extra_kwargs = {"ServerSideEncryption": "aws:kms", "SSEKMSKeyId": kms_key}
-            self._s3_client.upload_file(object_path, bucket, key, ExtraArgs=extra_kwargs)
+            self._s3_client.upload_file(
+                object_path,
+                bucket,
+                key,
+                ExtraArgs=extra_kwargs,
+                Config=self.transfer_config(os.path.getsize(object_path)),
+            )
         except ClientError:
             msg = "Error uploading object: {}/{}".format(bucket, key)
             self._logger.exception(msg)
@@ -50,42 +384,279 @@ class S3Interface:
 
     def list_objects(self, bucket, keys_path):
         keys_path = unquote_plus(keys_path)
-        self._logger.info("Listing objects in: s3://{}/{}".format(bucket, keys_path))
         keys_path = keys_path + "/" if not keys_path.endswith("/") else keys_path
-        keys = []
-        paginator = self._s3_client.get_paginator("list_objects_v2")
-        pages = paginator.paginate(Bucket=bucket, Prefix=keys_path)
+        return [obj.key for obj in self.iter_objects(bucket, keys_path)]
+
+    def _iter_listing(self, bucket, prefix, start_after=None, delimiter=None):
+        """Yields the pages of a listing as (objects, common prefixes), folder markers (keys ending with /) skipped"""
+        request = {"Bucket": bucket, "Prefix": prefix}
+        if start_after:
+            request["StartAfter"] = start_after
+        if delimiter:
+            request["Delimiter"] = delimiter
+        for page in self._s3_client.get_paginator("list_objects_v2").paginate(**request):
+            objects = [
+                ObjectMetadata(obj["Key"], obj["Size"], obj["LastModified"], obj["ETag"])
+                for obj in page.get("Contents", [])
+                if not obj["Key"].endswith("/")
+            ]
+            yield objects, [common_prefix["Prefix"] for common_prefix in page.get("CommonPrefixes", [])]
+
+    def iter_objects(self, bucket, prefix="", start_after=None, fan_out=False, max_workers=None):
+        """Generator of ObjectMetadata(key, size, last_modified, etag) of the objects under prefix, page by page
+
+        :param start_after: only list keys after this one, e.g. the last key of a previous, interrupted listing
+        :param fan_out: list the prefix one level deep with a / delimiter first, then list each of the common
+            prefixes found in parallel (max_workers threads). Objects are not yielded in key order then
+        """
+        prefix = unquote_plus(prefix)
+        self._logger.info("Listing objects in: s3://{}/{}".format(bucket, prefix))
+        try:
+            if not fan_out:
+                for objects, _ in self._iter_listing(bucket, prefix, start_after):
+                    yield from objects
+                return
+
+            common_prefixes = []
+            for objects, page_prefixes in self._iter_listing(bucket, prefix, start_after, delimiter="/"):
+                yield from objects
+                common_prefixes.extend(page_prefixes)
+            # the common prefix holding start_after may be rolled up before it and left out of the listing
+            if start_after and start_after.startswith(prefix) and "/" in start_after[len(prefix) :]:
+                start_after_prefix = prefix + start_after[len(prefix) :].split("/", 1)[0] + "/"
+                if start_after_prefix not in common_prefixes:
+                    common_prefixes.insert(0, start_after_prefix)
+            yield from self._iter_prefixes_in_parallel(bucket, common_prefixes, start_after, max_workers)
+        except ClientError:
+            msg = "Error listing objects in: s3://{}/{}".format(bucket, prefix)
+            self._logger.exception(msg)
+            raise
+
+    def get_objects_metadata(self, bucket, keys, max_workers=None):
+        """Returns the ObjectMetadata of the keys of bucket, in the order of keys
+
+        Metadata comes from listing the range of keys between the lowest and the highest one, a fraction of the
+        round trips of one HEAD per key. Keys not found in the listing (e.g. the range holds too many other objects
+        to be worth listing) are fetched with HEAD requests on max_workers threads.
+        """
+        keys = list(keys)
+        if not keys:
+            return []
+        wanted = set(keys)
+        metadata = {}
+        first_key, last_key = min(wanted), max(wanted)
+        prefix = os.path.commonprefix([first_key, last_key])
+        # StartAfter is exclusive, start after a string sorting right before the first key
+        listing = self._iter_listing(bucket, prefix, start_after=first_key[:-1] or None)
+        max_listed = 1000 + 10 * len(wanted)
+        listed = 0
+        for objects, _ in listing:
+            listed += len(objects)
+            metadata.update((obj.key, obj) for obj in objects if obj.key in wanted)
+            if len(metadata) == len(wanted) or listed >= max_listed or (objects and objects[-1].key >= last_key):
+                break
+        listing.close()
+
+        unlisted = [key for key in wanted if key not in metadata]
+        if unlisted:
+            self._logger.info("Fetching metadata of {} unlisted objects with HEAD requests".format(len(unlisted)))
+            with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+                metadata.update(
+                    zip(unlisted, executor.map(lambda key: self.head_object_metadata(bucket, key), unlisted))
+                )
+        return [metadata[key] for key in keys]
+
+    def head_object_metadata(self, bucket, key):
+        try:
+            response = self._s3_client.head_object(Bucket=bucket, Key=key)
+        except ClientError:
+            msg = "Error getting metadata of object: {}/{}".format(bucket, key)
+            self._logger.exception(msg)
+            raise
+        return ObjectMetadata(key, response["ContentLength"], response["LastModified"], response["ETag"])
+
+    def _iter_prefixes_in_parallel(self, bucket, prefixes, start_after, max_workers):
+        # pages are handed over through a bounded queue, memory stays flat whatever the number of objects
+        pages = queue.Queue(maxsize=(max_workers or self.max_workers) * 2)
+        stopped = threading.Event()
+
+        def hand_over(item):
+            # gives up once the consumer stopped, e.g. the generator was closed
+            while not stopped.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def list_prefix(prefix):
+            try:
+                # StartAfter applies to the prefix containing it, prefixes before it hold keys lower than it
+                prefix_start_after = start_after if start_after and start_after.startswith(prefix) else None
+                for objects, _ in self._iter_listing(bucket, prefix, prefix_start_after):
+                    hand_over(objects)
+            except Exception as e:
+                hand_over(e)
 
-        for page in pages:
-            for obj in page["Contents"]:
-                if obj["Key"][-1] != "/":
-                    keys.append(obj["Key"])
-        return keys
+        prefixes = [
+            prefix for prefix in prefixes if not start_after or start_after < prefix or start_after.startswith(prefix)
+        ]
+        with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+            futures = [executor.submit(list_prefix, prefix) for prefix in prefixes]
+            try:
+                while not all(future.done() for future in futures) or not pages.empty():
+                    try:
+                        objects = pages.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    if isinstance(objects, Exception):
+                        raise objects
+                    yield from objects
+            finally:
+                stopped.set()
+                for future in futures:
+                    future.cancel()
 
     def read_object(self, bucket, key):
         key = unquote_plus(key)
         self._logger.info("Reading object from {}/{}".format(bucket, key))
-        data = StringIO()
+        # parts are decoded as they arrive, \r\n line endings translated even when split across two parts
+        decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder("utf-8")(), translate=True)
+        data = StringIO(newline="")
+        parts = self._iter_parts(bucket, key, self.read_part_size, self.max_workers)
+        last = ""
         try:
-            obj = self._s3_client.get_object(Bucket=bucket, Key=key)
-            for line in obj["Body"].iter_lines():
-                data.write("{}\n".format(line.decode("utf-8")))
-            data.seek(0)
+            for text in itertools.chain((decoder.decode(part) for _, _, part in parts), [decoder.decode(b"", True)]):
+                data.write(text)
+                last = text[-1:] or last
         except ClientError:
             msg = "Error reading object: {}/{}".format(bucket, key)
             self._logger.exception(msg)
             raise
+        # content ends with a newline as it did when read line by line
+        if last and last != "\n":
+            data.write("\n")
+        data.seek(0)
         return data
 
+    def _get_range(self, bucket, key, start, end, etag=None):
+        extra_kwargs = {"IfMatch": etag} if etag else {}
+        return self._s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}", **extra_kwargs)
+
+    def _iter_parts(self, bucket, key, part_size, max_workers):
+        """Yields (offset, object size, bytes) of consecutive byte ranges of the object, fetched by max_workers threads
+
+        The first range GET also returns the size and ETag of the object, the other ranges are fetched with
+        If-Match so that an object overwritten during the read fails the read instead of mixing two versions.
+        """
+        try:
+            first = self._get_range(bucket, key, 0, part_size - 1)
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "InvalidRange":  # empty object
+                return
+            raise
+        size = int(first["ContentRange"].rsplit("/", 1)[1])
+        etag = first["ETag"]
+        yield 0, size, first["Body"].read()
+        offsets = iter(range(part_size, size, part_size))
+
+        def fetch(offset):
+            return self._get_range(bucket, key, offset, min(offset + part_size, size) - 1, etag)["Body"].read()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # sliding window of max_workers ranges, yielded in order
+            window = deque((offset, executor.submit(fetch, offset)) for _, offset in zip(range(max_workers), offsets))
+            try:
+                while window:
+                    offset, future = window.popleft()
+                    next_offset = next(offsets, None)
+                    if next_offset is not None:
+                        window.append((next_offset, executor.submit(fetch, next_offset)))
+                    yield offset, size, future.result()
+            finally:
+                for _, future in window:
+                    future.cancel()
+
+    def iter_object_chunks(self, bucket, key, chunk_size=None, max_workers=None):
+        """Generator of the content of an object as bytes chunks, without holding the whole object in memory
+
+        :param chunk_size: size of the chunks, defaults to read_part_size. With max_workers > 1 each chunk is a
+            byte-range GET, at most max_workers chunks are held in memory
+        :param max_workers: concurrent range GETs, defaults to the max_workers of the interface. 1 streams the
+            object with a single GET
+        """
+        chunk_size = chunk_size or self.read_part_size
+        max_workers = max_workers or self.max_workers
+        key = unquote_plus(key)
+        self._logger.info("Streaming object from {}/{}".format(bucket, key))
+        try:
+            if max_workers == 1:
+                yield from self._s3_client.get_object(Bucket=bucket, Key=key)["Body"].iter_chunks(chunk_size)
+            else:
+                for _, _, chunk in self._iter_parts(bucket, key, chunk_size, max_workers):
+                    yield chunk
+        except ClientError:
+            msg = "Error reading object: {}/{}".format(bucket, key)
+            self._logger.exception(msg)
+            raise
+
+    def iter_object_lines(self, bucket, key, encoding="utf-8", keepends=False, **kwargs):
+        """Generator of the lines of an object, decoded with encoding (bytes lines if encoding is None)
+
+        Accepts the chunk_size and max_workers arguments of iter_object_chunks.
+        """
+        pending = b""
+        for chunk in self.iter_object_chunks(bucket, key, **kwargs):
+            lines = (pending + chunk).splitlines(keepends=True)
+            # the last line may continue in the next chunk (including a \r followed by \n)
+            pending = lines.pop() if lines else b""
+            for raw_line in lines:
+                line = raw_line if keepends else raw_line.rstrip(b"\r\n")
+                yield line.decode(encoding) if encoding else line
+        if pending:
+            pending = pending if keepends else pending.rstrip(b"\r\n")
+            yield pending.decode(encoding) if encoding else pending
+
+    def read_object_bytes(self, bucket, key, max_workers=None):
+        """Reads a whole object with parallel range GETs into a single buffer and returns a memoryview of it
+
+        Ranges are written at their offset in one preallocated bytearray, no concatenation copy. Meant for binary
+        formats (parquet, avro, images) handed to libraries accepting bytes-like objects.
+        """
+        key = unquote_plus(key)
+        buffer = bytearray()
+        parts = self._iter_parts(bucket, key, self.read_part_size, max_workers or self.max_workers)
+        for offset, size, part in parts:
+            if not offset:
+                buffer = bytearray(size)
+            buffer[offset : offset + len(part)] = part
+        return memoryview(buffer)
+
     def write_object(self, bucket, key, data_object, kms_key=None):
         self._logger.info("Writing object to {}/{}".format(bucket, key))
+        # always rewind for safety
+        data_object.seek(0)
+        self.upload_stream(data_object, bucket, key, kms_key=kms_key)
+
+    def upload_stream(self, chunks, bucket, key, kms_key=None, size=None):
+        """Uploads an object from a file-like (binary or text) or an iterable of bytes or str chunks
+
+        Content is read part by part and sent with a multipart upload above the part size, at most max_concurrency
+        parts are held in memory. Pass the size when known to tune the part size, it defaults to a part size
+        allowing objects up to 80 GB.
+        """
+        self._logger.info("Uploading stream to {}/{}".format(bucket, key))
         try:
-            # always rewind for safety
-            data_object.seek(0)
             extra_kwargs = {}
             if kms_key:
                 extra_kwargs = {"ServerSideEncryption": "aws:kms", "SSEKMSKeyId": kms_key}
-            self._s3_client.put_object(Bucket=bucket, Key=key, Body=data_object.read(), **extra_kwargs)
+            if isinstance(chunks, io.RawIOBase | io.BufferedIOBase):
+                file_object = chunks
+            else:
+                file_object = io.BufferedReader(_ChunkReader(chunks), MB)
+            self._s3_client.upload_fileobj(
+                file_object, bucket, key, ExtraArgs=extra_kwargs, Config=self.transfer_config(size)
+            )
         except ClientError:
             msg = "Error uploading object: {}/{}".format(bucket, key)
             self._logger.exception(msg)
@@ -99,11 +670,7 @@ class S3Interface:
             )
         )
         try:
-            extra_kwargs = {}
-            if kms_key:
-                extra_kwargs = {"ServerSideEncryption": "aws:kms", "SSEKMSKeyId": kms_key}
-            copy_source = {"Bucket": source_bucket, "Key": source_key}
-            self._s3_client.copy(copy_source, dest_bucket, dest_key if dest_key else source_key, ExtraArgs=extra_kwargs)
+            self._copy(source_bucket, source_key, dest_bucket, dest_key if dest_key else source_key, kms_key=kms_key)
         except ClientError:
             msg = "Error copying object: {}/{} to {}/{}".format(
                 source_bucket, source_key, dest_bucket, dest_key if dest_key else source_key
@@ -111,6 +678,148 @@ class S3Interface:
             self._logger.exception(msg)
             raise
 
+    def _copy(
+        self, source_bucket, source_key, dest_bucket, dest_key, *, kms_key=None, preserve_kms_key=False, size=None
+    ):
+        """Server-side copy, a single CopyObject up to the part size, parallel UploadPartCopy above (required over
+        5 GB). Returns the size of the object, None if it was copied without knowing it
+
+        Without size, a single CopyObject is tried first: the source is only read with a HEAD request when its KMS
+        key is needed, or when it is refused as too large for a single copy.
+        """
+        copy_source = {"Bucket": source_bucket, "Key": source_key}
+        extra_kwargs = {}
+        if kms_key:
+            extra_kwargs = {"ServerSideEncryption": "aws:kms", "SSEKMSKeyId": kms_key}
+        if size is None and not (preserve_kms_key and not kms_key):
+            try:
+                self._s3_client.copy_object(CopySource=copy_source, Bucket=dest_bucket, Key=dest_key, **extra_kwargs)
+                return None
+            except ClientError as e:
+                # sources over 5 GB are refused, they need a multipart copy
+                if e.response["Error"]["Code"] != "InvalidRequest":
+                    raise
+        if size is None or (preserve_kms_key and not kms_key):
+            source = self._s3_client.head_object(**copy_source)
+            size = source["ContentLength"]
+            # without encryption arguments the copy gets the default encryption of the destination bucket
+            if preserve_kms_key and not kms_key and source.get("ServerSideEncryption") == "aws:kms":
+                extra_kwargs = {"ServerSideEncryption": "aws:kms", "SSEKMSKeyId": source["SSEKMSKeyId"]}
+        transfer_config = self.transfer_config(size)
+        if size <= transfer_config.multipart_threshold:
+            self._s3_client.copy_object(CopySource=copy_source, Bucket=dest_bucket, Key=dest_key, **extra_kwargs)
+        else:
+            self._s3_client.copy(copy_source, dest_bucket, dest_key, ExtraArgs=extra_kwargs, Config=transfer_config)
+        return size
+
+    def copy_objects(self, pairs, *, kms_key=None, preserve_kms_key=False, checkpoint_path=None):
+        """Server-side copies of many objects, max_workers at a time
+
+        :param pairs: iterable of (source bucket, source key, destination bucket, destination key) tuples, a fifth
+            element with the object size (e.g. from iter_objects) is counted in copied_bytes and sends objects above
+            the part size straight to multipart copy
+        :param kms_key: KMS key id of the copies, overriding the encryption of the sources
+        :param preserve_kms_key: without kms_key, copies are encrypted with the KMS key of their source, instead of
+            the default encryption of the destination bucket
+        :param checkpoint_path: JSON lines file recording each completed copy. Copies already recorded are skipped,
+            an interrupted bulk copy resumes where it stopped when called again with the same file
+        :return: CopySummary, failed copies are also raised with ObjectCopyFailedException once all copies ran
+        """
+        summary = self._copy_objects(pairs, kms_key, preserve_kms_key, checkpoint_path)
+        if summary.failed:
+            raise ObjectCopyFailedException(json.dumps(summary.failed))
+        return summary
+
+    def _copy_objects(self, pairs, kms_key, preserve_kms_key, checkpoint_path, on_copied=None):
+        summary = CopySummary()
+        start = time.perf_counter()
+        completed = set()
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, encoding="utf-8") as checkpoint:
+                completed = {tuple(json.loads(line)["copy"]) for line in checkpoint if line.strip()}
+        checkpoint = open(checkpoint_path, "a", encoding="utf-8") if checkpoint_path else None
+
+        def copy(pair, size):
+            return self._copy(*pair, kms_key=kms_key, preserve_kms_key=preserve_kms_key, size=size)
+
+        def collect(done):
+            for future in done:
+                pair = futures_pairs.pop(future)
+                try:
+                    summary.copied_bytes += future.result() or 0
+                except ClientError as e:
+                    self._logger.error("Error copying object: {}/{} to {}/{}: {}".format(*pair, e))
+                    summary.failed.append({"copy": pair, "Code": e.response["Error"]["Code"], "Message": str(e)})
+                    continue
+                summary.copied += 1
+                if checkpoint:
+                    # written and flushed by this thread only, a crash loses at most the copies in flight
+                    checkpoint.write(json.dumps({"copy": pair}) + "\n")
+                    checkpoint.flush()
+                if on_copied:
+                    on_copied(pair)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures_pairs = {}
+                for source_bucket, source_key, dest_bucket, dest_key, *size in pairs:
+                    pair = (source_bucket, source_key, dest_bucket, dest_key)
+                    if pair in completed:
+                        summary.skipped += 1
+                        if on_copied:
+                            on_copied(pair)
+                        continue
+                    if len(futures_pairs) >= self.max_workers * 2:
+                        done, _ = wait(futures_pairs, return_when=FIRST_COMPLETED)
+                        collect(done)
+                    futures_pairs[executor.submit(copy, pair, size[0] if size else None)] = pair
+                collect(wait(futures_pairs).done)
+        finally:
+            if checkpoint:
+                checkpoint.close()
+        summary.elapsed = time.perf_counter() - start
+        self._logger.info("Copied objects: {}".format(summary))
+        return summary
+
+    def move_prefix(
+        self,
+        source_bucket,
+        source_prefix,
+        dest_bucket,
+        dest_prefix,
+        *,
+        kms_key=None,
+        preserve_kms_key=False,
+        checkpoint_path=None,
+    ):
+        """Moves all objects under source_prefix to dest_prefix: concurrent server-side copies, then deletion of the
+        copied sources in 1000-key batches. kms_key, preserve_kms_key and checkpoint_path are those of copy_objects
+
+        Sources are only deleted once copied, and skipped copies of a resumed move are deleted too.
+        """
+        source_prefix = unquote_plus(source_prefix)
+        self._logger.info(
+            "Moving objects from {}/{} to {}/{}".format(source_bucket, source_prefix, dest_bucket, dest_prefix)
+        )
+        pairs = (
+            (source_bucket, obj.key, dest_bucket, dest_prefix + obj.key[len(source_prefix) :], obj.size)
+            for obj in self.iter_objects(source_bucket, source_prefix)
+        )
+        copied_keys = []
+
+        def delete_copied(pair=None):
+            if pair:
+                copied_keys.append(pair[1])
+            if copied_keys and (pair is None or len(copied_keys) >= self.max_delete_keys):
+                self.delete_keys(source_bucket, copied_keys)
+                copied_keys.clear()
+
+        summary = self._copy_objects(pairs, kms_key, preserve_kms_key, checkpoint_path, on_copied=delete_copied)
+        delete_copied()
+        if summary.failed:
+            raise ObjectCopyFailedException(json.dumps(summary.failed))
+        return summary
+
     def tag_object(self, bucket, key, tag_dict):
         self._logger.info("Tagging s3 object {}/{} with values {}".format(bucket, key, tag_dict))
         try:
@@ -122,21 +831,88 @@ class S3Interface:
             self._logger.exception(msg)
             raise
 
-    def delete_objects(self, bucket, prefix):
+    def delete_objects(self, bucket, prefix, versions=False, raise_on_failure=True):
+        """Deletes all objects under prefix, listing and 1000-key DeleteObjects calls are pipelined on a thread pool
+
+        :param versions: delete every version and delete marker of the objects of a versioned bucket, instead of
+            adding delete markers
+        :param raise_on_failure: raise ObjectDeleteFailedException listing the keys still failing after retries
+        :return: DeleteSummary with the number of deleted keys, the failed ones and the elapsed time
+        """
         prefix = unquote_plus(prefix)
         self._logger.info("Deleting all objects in bucket {} with prefix {}".format(bucket, prefix))
-        object_paginator = self._s3_client.get_paginator("list_objects_v2")
-        response_iterator = object_paginator.paginate(Bucket=bucket, Prefix=prefix)
-        for response in response_iterator:
-            if "Contents" in response:
-                objects_to_delete = [{"Key": obj["Key"]} for obj in response["Contents"]]
-                delete_response = self._s3_client.delete_objects(Bucket=bucket, Delete={"Objects": objects_to_delete})
-                if "Errors" in delete_response:
-                    self._logger.info("Object delete failed")
-                    delete_errors = delete_response["Errors"]
-                    raise ObjectDeleteFailedException(json.dumps(delete_errors))
-
-        self._logger.info("Successfully deleted all objects in bucket {} with prefix {}".format(bucket, prefix))
+        if versions:
+            pages = self._s3_client.get_paginator("list_object_versions").paginate(Bucket=bucket, Prefix=prefix)
+            batches = (
+                [
+                    {"Key": version["Key"], "VersionId": version["VersionId"]}
+                    for version in page.get("Versions", []) + page.get("DeleteMarkers", [])
+                ]
+                for page in pages
+            )
+        else:
+            pages = self._s3_client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix)
+            batches = ([{"Key": obj["Key"]} for obj in page.get("Contents", [])] for page in pages)
+        summary = self._delete_batches(bucket, batches, raise_on_failure)
+        self._logger.info("Deleted objects in bucket {} with prefix {}: {}".format(bucket, prefix, summary))
+        return summary
+
+    def delete_keys(self, bucket, keys, raise_on_failure=True):
+        """Deletes keys, given as strings or (key, version id) tuples, with concurrent 1000-key DeleteObjects calls
+
+        :return: DeleteSummary with the number of deleted keys, the failed ones and the elapsed time
+        """
+        objects = ({"Key": key} if isinstance(key, str) else {"Key": key[0], "VersionId": key[1]} for key in keys)
+        batches = iter(lambda: list(itertools.islice(objects, self.max_delete_keys)), [])
+        summary = self._delete_batches(bucket, batches, raise_on_failure)
+        self._logger.info("Deleted keys in bucket {}: {}".format(bucket, summary))
+        return summary
+
+    def _delete_batches(self, bucket, batches, raise_on_failure):
+        summary = DeleteSummary()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = set()
+            for batch in batches:
+                # list pages and delete batches hold at most 1000 keys, a page is deleted while the next one is listed
+                for offset in range(0, len(batch), self.max_delete_keys):
+                    if len(futures) >= self.max_workers * 2:
+                        done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                        summary.add(*(future.result() for future in done))
+                    futures.add(
+                        executor.submit(self._delete_batch, bucket, batch[offset : offset + self.max_delete_keys])
+                    )
+            summary.add(*(future.result() for future in futures))
+        summary.elapsed = time.perf_counter() - start
+        if summary.failed and raise_on_failure:
+            self._logger.info("Object delete failed")
+            raise ObjectDeleteFailedException(json.dumps(summary.failed))
+        return summary
+
+    def _delete_batch(self, bucket, objects, max_retries=5):
+        """Deletes up to 1000 objects, retrying only the keys that failed. Returns (deleted count, errors)"""
+        deleted = 0
+        final_errors = []
+        attempt = 0
+        while True:
+            try:
+                response = self._s3_client.delete_objects(Bucket=bucket, Delete={"Objects": objects, "Quiet": True})
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in THROTTLING_ERROR_CODES or attempt >= max_retries:
+                    raise
+                errors = [{**obj, "Code": e.response["Error"]["Code"]} for obj in objects]
+            else:
+                errors = response.get("Errors", [])
+                # quiet mode only reports errors
+                deleted += len(objects) - len(errors)
+            final_errors.extend(error for error in errors if error["Code"] not in self.retryable_error_codes)
+            errors = [error for error in errors if error["Code"] in self.retryable_error_codes]
+            if not errors or attempt >= max_retries:
+                return deleted, final_errors + errors
+            failed = {(error["Key"], error.get("VersionId")) for error in errors}
+            objects = [obj for obj in objects if (obj["Key"], obj.get("VersionId")) in failed]
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
 
     def get_size(self, bucket, key):
         return self._s3_client.head_object(Bucket=bucket, Key=key)["ContentLength"]
@@ -1,36 +1,360 @@
+import hashlib
+import json
 import math
 import os
+import queue
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Optional
 
-import boto3
-from botocore.client import Config
 from botocore.exceptions import ClientError
 
-from ..commons import init_logger
+from ..claim_check import rehydrate
+from ..clients import get_client, regional_endpoint
+from ..commons import THROTTLING_ERROR_CODES, backoff_delay, init_logger
+from ..datalake_exceptions import MessageSendFailedException
+
+
+class SendResult(NamedTuple):
+    """Outcome of sending one message, message_id is None when the message could not be sent"""
+
+    message_id: Optional[str]
+    error_code: Optional[str] = None
+    error_message: Optional[str] = None
+
+
+class SQSConsumer:
+    """Iterator over the messages of a queue, deleted only once acknowledged
+
+    A prefetch thread long-polls the queue while messages are processed, a heartbeat thread extends the visibility
+    timeout of the messages received but not acknowledged yet, acknowledgements are sent in batches of 10. Messages
+    not acknowledged are redelivered after their visibility timeout: at-least-once processing.
+
+        with queue_interface.consume() as consumer:
+            for message in consumer:
+                process(message["Body"])
+                consumer.ack(message)
+    """
+
+    max_batch_size = 10
+
+    def __init__(
+        self,
+        sqs_client,
+        queue_url,
+        *,
+        max_messages=None,
+        wait_time_seconds=20,
+        visibility_timeout=None,
+        stop_when_empty=True,
+        prefetch=20,
+        log_level=None,
+    ):
+        """
+        :param max_messages: stop after receiving that many messages, defaults to no limit
+        :param wait_time_seconds: long polling duration of each receive call
+        :param visibility_timeout: visibility timeout of the received messages, extended every half of it while they
+            are not acknowledged. Defaults to the visibility timeout of the queue
+        :param stop_when_empty: stop once a receive call returns no message, otherwise poll until closed
+        :param prefetch: number of messages received ahead of processing
+        """
+        self.log_level = log_level or os.getenv("LOG_LEVEL", "INFO")
+        self._logger = init_logger(__name__, self.log_level)
+        self._sqs_client = sqs_client
+        self._queue_url = queue_url
+        self._max_messages = max_messages
+        self._wait_time_seconds = wait_time_seconds
+        self._visibility_timeout = visibility_timeout
+        self._stop_when_empty = stop_when_empty
+        self._buffer = queue.Queue(maxsize=max(prefetch, self.max_batch_size))
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        # messages received and not acknowledged yet, by receipt handle
+        self._in_flight = {}
+        self._delivered = set()
+        self._pending_acks = []
+        self._error = None
+        self.received = 0
+        self.acked = 0
+        self.failed_acks = []
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def start(self):
+        if self._visibility_timeout is None:
+            self._visibility_timeout = int(
+                self._sqs_client.get_queue_attributes(QueueUrl=self._queue_url, AttributeNames=["VisibilityTimeout"])[
+                    "Attributes"
+                ]["VisibilityTimeout"]
+            )
+        self._threads = [
+            threading.Thread(target=self._prefetch, daemon=True),
+            threading.Thread(target=self._heartbeat, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        message = self._buffer.get()
+        if message is None:
+            # end of the prefetching, left in the buffer for other readers
+            self._buffer.put(None)
+            if self._error:
+                raise self._error
+            raise StopIteration
+        with self._lock:
+            self._delivered.add(message["ReceiptHandle"])
+        return message
+
+    def _prefetch(self):
+        try:
+            while not self._stopped.is_set():
+                max_number = self.max_batch_size
+                if self._max_messages:
+                    max_number = min(max_number, self._max_messages - self.received)
+                    if max_number <= 0:
+                        break
+                messages = self._sqs_client.receive_message(
+                    QueueUrl=self._queue_url,
+                    MaxNumberOfMessages=max_number,
+                    WaitTimeSeconds=self._wait_time_seconds,
+                    VisibilityTimeout=self._visibility_timeout,
+                ).get("Messages", [])
+                if not messages and self._stop_when_empty:
+                    break
+                self.received += len(messages)
+                with self._lock:
+                    self._in_flight.update((message["ReceiptHandle"], message) for message in messages)
+                for message in messages:
+                    self._hand_over(message)
+        except Exception as e:
+            self._logger.error("Error receiving messages: %s", e, exc_info=True)
+            self._error = e
+        finally:
+            self._hand_over(None)
+
+    def _hand_over(self, message):
+        while not self._stopped.is_set():
+            try:
+                self._buffer.put(message, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _heartbeat(self):
+        interval = max(self._visibility_timeout / 2, 1)
+        while not self._stopped.wait(interval):
+            with self._lock:
+                receipt_handles = list(self._in_flight)
+            self._change_visibility(receipt_handles, self._visibility_timeout)
+
+    def _change_visibility(self, receipt_handles, visibility_timeout):
+        for offset in range(0, len(receipt_handles), self.max_batch_size):
+            entries = [
+                {"Id": str(index), "ReceiptHandle": receipt_handle, "VisibilityTimeout": visibility_timeout}
+                for index, receipt_handle in enumerate(receipt_handles[offset : offset + self.max_batch_size])
+            ]
+            try:
+                response = self._sqs_client.change_message_visibility_batch(QueueUrl=self._queue_url, Entries=entries)
+            except ClientError as e:
+                self._logger.warning("Error changing visibility of messages: %s", e)
+                continue
+            for failed in response.get("Failed", []):
+                # e.g. a message acknowledged meanwhile
+                self._logger.debug("Visibility change failed: %s", failed)
+
+    def ack(self, message):
+        """Acknowledges a processed message, deleted from the queue with the next batch of 10"""
+        with self._lock:
+            self._in_flight.pop(message["ReceiptHandle"], None)
+            self._delivered.discard(message["ReceiptHandle"])
+            self._pending_acks.append(message)
+            pending = len(self._pending_acks)
+        if pending >= self.max_batch_size:
+            self.flush_acks()
+
+    def nack(self, message):
+        """Makes a message visible again right away, instead of after its visibility timeout"""
+        with self._lock:
+            self._in_flight.pop(message["ReceiptHandle"], None)
+            self._delivered.discard(message["ReceiptHandle"])
+        self._change_visibility([message["ReceiptHandle"]], 0)
+
+    def flush_acks(self):
+        with self._lock:
+            messages, self._pending_acks = self._pending_acks, []
+        for offset in range(0, len(messages), self.max_batch_size):
+            batch = messages[offset : offset + self.max_batch_size]
+            entries = [
+                {"Id": str(index), "ReceiptHandle": message["ReceiptHandle"]} for index, message in enumerate(batch)
+            ]
+            response = self._sqs_client.delete_message_batch(QueueUrl=self._queue_url, Entries=entries)
+            self.acked += len(response.get("Successful", []))
+            for failed in response.get("Failed", []):
+                self._logger.error("Error deleting message %s: %s", batch[int(failed["Id"])]["MessageId"], failed)
+                self.failed_acks.append(batch[int(failed["Id"])])
+
+    def close(self):
+        """Stops receiving, makes prefetched messages never handed out visible again and sends pending acks"""
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        with self._lock:
+            undelivered = [
+                receipt_handle for receipt_handle in self._in_flight if receipt_handle not in self._delivered
+            ]
+            for receipt_handle in undelivered:
+                del self._in_flight[receipt_handle]
+        self._change_visibility(undelivered, 0)
+        self.flush_acks()
+        self._logger.info(
+            f"Consumed {self.received} messages, {self.acked} acknowledged, {len(self.failed_acks)} failed to delete"
+        )
 
 
 class SQSInterface:
-    def __init__(self, queue_name, log_level=None, sqs_client=None):
+    max_batch_size = 10
+    # payload limit of a SendMessageBatch request, sum of the message bodies
+    max_batch_bytes = 256 * 1024
+
+    def __init__(self, queue_name, log_level=None, sqs_client=None, max_workers=None, *, claim_check=None):
+        """
+        :param max_workers: number of concurrent receivers of drain, defaults to the SDLF_SQS_WORKERS env variable or 8
+        :param claim_check: ClaimCheck storing the messages sent that are larger than its threshold in S3, the queue
+            then gets a pointer rehydrated by receive_min_max_messages
+        """
         self.log_level = log_level or os.getenv("LOG_LEVEL", "INFO")
         self._logger = init_logger(__name__, self.log_level)
-        sqs_endpoint_url = "https://sqs." + os.getenv("AWS_REGION") + ".amazonaws.com"
-        session_config = Config(user_agent="awssdlf/2.11.0")
-        self._sqs_client = sqs_client or boto3.client("sqs", endpoint_url=sqs_endpoint_url, config=session_config)
+        self._sqs_client = sqs_client or get_client("sqs", endpoint_url=regional_endpoint("sqs"))
+        self.max_workers = max_workers or int(os.getenv("SDLF_SQS_WORKERS", "8"))
+        self._claim_check = claim_check
 
         self._message_queue = self._sqs_client.get_queue_url(QueueName=queue_name)["QueueUrl"]
 
+    def get_queue_depth(self):
+        """Returns the approximate number of messages available and in flight in the queue"""
+        attributes = self._sqs_client.get_queue_attributes(
+            QueueUrl=self._message_queue,
+            AttributeNames=["ApproximateNumberOfMessages", "ApproximateNumberOfMessagesNotVisible"],
+        )["Attributes"]
+        return int(attributes["ApproximateNumberOfMessages"]), int(attributes["ApproximateNumberOfMessagesNotVisible"])
+
+    def get_oldest_message_age(self, cloudwatch_client=None):
+        """Returns the age in seconds of the oldest message of the queue, from the ApproximateAgeOfOldestMessage
+        CloudWatch metric. Best effort: None when no datapoint was published in the last 5 minutes or the metric
+        cannot be read
+        """
+        cloudwatch_client = cloudwatch_client or get_client("cloudwatch")
+        now = datetime.now(timezone.utc)
+        try:
+            datapoints = cloudwatch_client.get_metric_statistics(
+                Namespace="AWS/SQS",
+                MetricName="ApproximateAgeOfOldestMessage",
+                Dimensions=[{"Name": "QueueName", "Value": self._message_queue.rsplit("/", 1)[-1]}],
+                StartTime=now - timedelta(minutes=5),
+                EndTime=now,
+                Period=60,
+                Statistics=["Maximum"],
+            )["Datapoints"]
+        except ClientError as e:
+            self._logger.warning("Unable to read the age of the oldest message: %s", e)
+            return None
+        if not datapoints:
+            return None
+        return max(datapoints, key=lambda datapoint: datapoint["Timestamp"])["Maximum"]
+
+    def consume(self, **kwargs):
+        """Returns an SQSConsumer of the queue, to be used as a context manager. See SQSConsumer for the arguments"""
+        return SQSConsumer(self._sqs_client, self._message_queue, log_level=self.log_level, **kwargs)
+
     def receive_messages(self, max_num_messages=1):
         messages = self._sqs_client.receive_message(
             QueueUrl=self._message_queue, MaxNumberOfMessages=max_num_messages, WaitTimeSeconds=1
-        )["Messages"]
-        for message in messages:
-            self._sqs_client.delete_message(QueueUrl=self._message_queue, ReceiptHandle=message["ReceiptHandle"])
+        ).get("Messages", [])
+        self._delete_messages(messages)
         return messages
 
-    def receive_min_max_messages(self, min_items_process, max_items_process):
+    def _delete_messages(self, messages):
+        if not messages:
+            return
+        response = self._sqs_client.delete_message_batch(
+            QueueUrl=self._message_queue,
+            Entries=[
+                {"Id": str(index), "ReceiptHandle": message["ReceiptHandle"]} for index, message in enumerate(messages)
+            ],
+        )
+        for failed in response.get("Failed", []):
+            self._logger.error("Error deleting message %s: %s", messages[int(failed["Id"])]["MessageId"], failed)
+
+    def drain(self, max_messages, *, max_workers=None, time_budget=None, wait_time_seconds=1):
+        """Receives and deletes up to max_messages messages with concurrent receivers
+
+        Receivers stop once the queue looks empty (a receive call returns no message), max_messages messages are
+        received or the time budget is spent. Messages received more than once are returned once.
+        :param max_messages: maximum number of messages to receive
+        :param max_workers: maximum number of concurrent receivers, defaults to the max_workers of the interface
+        :param time_budget: seconds after which no receive call is started, defaults to no limit
+        :param wait_time_seconds: long polling duration of each receive call
+        :return: the messages, deduplicated by MessageId, in the order they were received
+        """
+        max_workers = min(max_workers or self.max_workers, math.ceil(max_messages / self.max_batch_size))
+        if max_workers <= 0:
+            return []
+        deadline = time.monotonic() + time_budget if time_budget else None
+        messages = {}
+        lock = threading.Lock()
+        # messages received or being received, receivers claim up to 10 of the max_messages before each call
+        claimed = 0
+        duplicates = 0
+
+        def receiver():
+            nonlocal claimed, duplicates
+            while not deadline or time.monotonic() < deadline:
+                with lock:
+                    max_number = min(self.max_batch_size, max_messages - claimed)
+                    if max_number <= 0:
+                        return
+                    claimed += max_number
+                received = self._sqs_client.receive_message(
+                    QueueUrl=self._message_queue, MaxNumberOfMessages=max_number, WaitTimeSeconds=wait_time_seconds
+                ).get("Messages", [])
+                with lock:
+                    new = [message for message in received if message["MessageId"] not in messages]
+                    messages.update((message["MessageId"], message) for message in new)
+                    duplicates += len(received) - len(new)
+                    claimed -= max_number - len(new)
+                # redelivered copies are deleted too, their previous receipt handle is no longer valid
+                self._delete_messages(received)
+                if not received:
+                    return
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for future in [executor.submit(receiver) for _ in range(max_workers)]:
+                future.result()
+        self._logger.info(
+            f"Drained {len(messages)} messages ({duplicates} duplicates) with {max_workers} receivers"
+            f" in {time.perf_counter() - start:.2f} s"
+        )
+        return list(messages.values())
+
+    def receive_min_max_messages(self, min_items_process, max_items_process, **kwargs):
         """Gets max_items_process messages from an SQS queue.
         :param min_items_process: Minimum number of items to process.
         :param max_items_process: Maximum number of items to process.
+        :param kwargs: max_workers, time_budget and wait_time_seconds of drain
         :return messages obtained
         """
         messages = []
@@ -45,26 +369,14 @@ class SQSInterface:
             self._logger.info("Not enough messages - exiting")
             return messages
 
-        # Only pull batch sizes of max_batch_size
-        num_messages_queue = min(num_messages_queue, max_items_process)
-        max_batch_size = 10
-        batch_sizes = [max_batch_size] * math.floor(num_messages_queue / max_batch_size)
-        if num_messages_queue % max_batch_size > 0:
-            batch_sizes += [num_messages_queue % max_batch_size]
-
-        for batch_size in batch_sizes:
-            resp_msg = self.receive_messages(max_num_messages=batch_size)
-            try:
-                messages.extend(message["Body"] for message in resp_msg)
-            except KeyError:
-                break
-        return messages
+        messages = self.drain(min(num_messages_queue, max_items_process), **kwargs)
+        return [rehydrate(message["Body"]) for message in messages]
 
     def send_message_to_fifo_queue(self, message, group_id):
         try:
             self._sqs_client.send_message(
                 QueueUrl=self._message_queue,
-                MessageBody=message,
+                MessageBody=self._claim_check.offload(message) if self._claim_check else message,
                 MessageGroupId=group_id,
                 MessageDeduplicationId=str(uuid.uuid1()),
             )
@@ -72,20 +384,91 @@ class SQSInterface:
             self._logger.error("Received error: %s", e, exc_info=True)
             raise e
 
-    def send_batch_messages_to_fifo_queue(self, messages, batch_size, group_id):
-        try:
-            chunks = [messages[x : x + batch_size] for x in range(0, len(messages), batch_size)]
-            for chunk in chunks:
-                entries = []
-                for x in chunk:
-                    entry = {
-                        "Id": str(uuid.uuid1()),
-                        "MessageBody": str(x),
-                        "MessageGroupId": group_id,
-                        "MessageDeduplicationId": str(uuid.uuid1()),
-                    }
+    def send_batch_messages_to_fifo_queue(
+        self, messages, batch_size, group_id, *, max_workers=None, max_retries=5, raise_on_failure=True
+    ):
+        """Sends messages in SendMessageBatch calls of up to batch_size (at most 10) messages and 256 KB
+
+        Batches are sent concurrently, the order of the messages is only kept within each batch. Deduplication IDs
+        are a hash of the group and the body: sending the same message again within the 5 minutes deduplication
+        interval of SQS, or twice in messages, delivers it once. With a claim check, messages above its threshold
+        are sent as pointers.
+        :param messages: str message bodies, other values are serialised to JSON
+        :param max_workers: number of concurrent SendMessageBatch calls, defaults to the max_workers of the interface
+        :param max_retries: number of retries of the entries that failed on AWS side or were throttled
+        :param raise_on_failure: raise MessageSendFailedException listing the messages that could not be sent
+        :return: a SendResult per message, in the order of messages
+        """
+        deduplication_ids = []
+        entries = {}
+        for index, message in enumerate(messages):
+            body = message if isinstance(message, str) else json.dumps(message)
+            deduplication_id = hashlib.sha256(f"{group_id}:{body}".encode("utf-8")).hexdigest()
+            deduplication_ids.append(deduplication_id)
+            entries.setdefault(
+                deduplication_id,
+                {
+                    "Id": str(index),
+                    "MessageBody": self._claim_check.offload(body) if self._claim_check else body,
+                    "MessageGroupId": group_id,
+                    "MessageDeduplicationId": deduplication_id,
+                },
+            )
+
+        results = {}
+        batches = []
+        batch, batch_bytes = [], 0
+        for entry in entries.values():
+            entry_bytes = len(entry["MessageBody"].encode("utf-8"))
+            if entry_bytes > self.max_batch_bytes:
+                results[entry["MessageDeduplicationId"]] = SendResult(
+                    None, "MessageTooLong", f"{entry_bytes} bytes, more than {self.max_batch_bytes}"
+                )
+                continue
+            if len(batch) >= min(batch_size, self.max_batch_size) or batch_bytes + entry_bytes > self.max_batch_bytes:
+                batches.append(batch)
+                batch, batch_bytes = [], 0
+            batch.append(entry)
+            batch_bytes += entry_bytes
+        if batch:
+            batches.append(batch)
+
+        with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+            for batch_results in executor.map(lambda batch: self._send_batch(batch, max_retries), batches):
+                results.update(batch_results)
+
+        results = [results[deduplication_id] for deduplication_id in deduplication_ids]
+        failed = {index: result for index, result in enumerate(results) if result.message_id is None}
+        self._logger.info(f"Sent {len(results) - len(failed)} messages in {len(batches)} batches, {len(failed)} failed")
+        if failed and raise_on_failure:
+            self._logger.error("Message send failed")
+            raise MessageSendFailedException(json.dumps({index: result._asdict() for index, result in failed.items()}))
+        return results
+
+    def _send_batch(self, entries, max_retries):
+        """Sends up to 10 entries, retrying only the failed ones. Returns a SendResult per deduplication ID"""
+        results = {}
+        for attempt in range(max_retries + 1):
+            entries_by_id = {entry["Id"]: entry for entry in entries}
+            try:
+                response = self._sqs_client.send_message_batch(QueueUrl=self._message_queue, Entries=entries)
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in THROTTLING_ERROR_CODES or attempt == max_retries:
+                    self._logger.error("Received error: %s", e, exc_info=True)
+                    raise
+                time.sleep(backoff_delay(attempt))
+                continue
+            for successful in response.get("Successful", []):
+                entry = entries_by_id[successful["Id"]]
+                results[entry["MessageDeduplicationId"]] = SendResult(successful["MessageId"])
+            entries = []
+            for failed in response.get("Failed", []):
+                entry = entries_by_id[failed["Id"]]
+                if failed["SenderFault"] or attempt == max_retries:
+                    results[entry["MessageDeduplicationId"]] = SendResult(None, failed["Code"], failed.get("Message"))
+                else:
                     entries.append(entry)
-                self._sqs_client.send_message_batch(QueueUrl=self._message_queue, Entries=entries)
-        except ClientError as e:
-            self._logger.error("Received error: %s", e, exc_info=True)
-            raise e
+            if not entries:
+                break
+            time.sleep(backoff_delay(attempt))
+        return results
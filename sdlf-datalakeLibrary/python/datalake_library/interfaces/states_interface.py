@@ -1,22 +1,195 @@
+import hashlib
 import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
+from typing import NamedTuple, Optional
 
-import boto3
-from botocore.client import Config
+from botocore.exceptions import ClientError
 
-from ..commons import init_logger
+from ..clients import get_client, regional_endpoint
+from ..commons import THROTTLING_ERROR_CODES, TokenBucket, backoff_delay, init_logger
+from ..datalake_exceptions import ExecutionStartFailedException
+
+
+class ExecutionStart(NamedTuple):
+    """Outcome of starting one execution, execution_arn is None when it could not be started"""
+
+    name: str
+    execution_arn: Optional[str]
+    already_started: bool = False
+    error: Optional[str] = None
+
+
+class ExecutionStatus(NamedTuple):
+    execution_arn: str
+    status: str
+    start_date: Optional[datetime] = None
+    stop_date: Optional[datetime] = None
+
+
+class ExecutionTracker:
+    """Tracks the status of many executions with few API calls
+
+    Executions of the same state machine are checked with paginated list_executions calls filtered on status
+    (1000 executions per call) rather than one describe_execution call each, executions of state machines with only
+    a few tracked executions are described in parallel. Polling slows down while nothing completes.
+
+        for execution in states_interface.execution_tracker().wait_all(execution_arns, timeout=3600):
+            print(execution.execution_arn, execution.status)
+    """
+
+    terminal_statuses = ("SUCCEEDED", "FAILED", "TIMED_OUT", "ABORTED")
+
+    def __init__(
+        self,
+        states_client,
+        *,
+        max_workers=None,
+        min_interval=1,
+        max_interval=30,
+        list_threshold=10,
+        log_level=None,
+    ):
+        """
+        :param max_workers: number of concurrent describe_execution calls, defaults to 8
+        :param min_interval: seconds between polls while executions complete
+        :param max_interval: seconds between polls the interval doubles up to while nothing completes
+        :param list_threshold: number of pending executions of a state machine from which it is listed rather than
+            its executions described
+        """
+        self.log_level = log_level or os.getenv("LOG_LEVEL", "INFO")
+        self._logger = init_logger(__name__, self.log_level)
+        self._states_client = states_client
+        self.max_workers = max_workers or 8
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.list_threshold = list_threshold
+        self.api_calls = 0
+
+    @staticmethod
+    def state_machine_arn(execution_arn):
+        """arn:aws:states:<region>:<account>:execution:<state machine>:<name> -> the state machine ARN"""
+        parts = execution_arn.split(":")
+        return ":".join([*parts[:5], "stateMachine", parts[6]])
+
+    def snapshot(self, machine_arn, status_filter=None, started_after=None):
+        """Returns the executions of machine_arn with status status_filter, by ARN
+
+        :param started_after: stop listing at executions started before this date, executions are listed most recent
+            first
+        """
+        executions = {}
+        kwargs = {"stateMachineArn": machine_arn, "maxResults": 1000}
+        if status_filter:
+            kwargs["statusFilter"] = status_filter
+        for page in self._states_client.get_paginator("list_executions").paginate(**kwargs):
+            self.api_calls += 1
+            for execution in page["executions"]:
+                if started_after and execution["startDate"] < started_after:
+                    return executions
+                executions[execution["executionArn"]] = ExecutionStatus(
+                    execution["executionArn"], execution["status"], execution["startDate"], execution.get("stopDate")
+                )
+        return executions
+
+    def describe(self, execution_arns):
+        """Describes executions in parallel, returns their status by ARN"""
+
+        def describe(execution_arn):
+            response = self._states_client.describe_execution(executionArn=execution_arn)
+            return ExecutionStatus(execution_arn, response["status"], response["startDate"], response.get("stopDate"))
+
+        self.api_calls += len(execution_arns)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return {execution.execution_arn: execution for execution in executor.map(describe, execution_arns)}
+
+    def poll(self, execution_arns, start_dates=None):
+        """Returns the current status of executions by ARN, recording in start_dates the start dates seen"""
+        start_dates = {} if start_dates is None else start_dates
+        statuses = {}
+        by_state_machine = {}
+        for execution_arn in execution_arns:
+            by_state_machine.setdefault(self.state_machine_arn(execution_arn), []).append(execution_arn)
+        to_describe = []
+        for machine_arn, arns in by_state_machine.items():
+            if len(arns) < self.list_threshold:
+                to_describe.extend(arns)
+                continue
+            running = self.snapshot(machine_arn, "RUNNING")
+            finished = []
+            for execution_arn in arns:
+                if execution_arn in running:
+                    statuses[execution_arn] = running[execution_arn]
+                    start_dates[execution_arn] = running[execution_arn].start_date
+                else:
+                    finished.append(execution_arn)
+            if finished and all(execution_arn in start_dates for execution_arn in finished):
+                # executions seen running before: list the recently completed ones instead of describing them
+                started_after = min(start_dates[execution_arn] for execution_arn in finished)
+                for status in self.terminal_statuses:
+                    completed = self.snapshot(machine_arn, status, started_after=started_after)
+                    statuses.update((arn, completed[arn]) for arn in finished if arn in completed)
+            # not listed: just started or started before tracking, or in another status (e.g. PENDING_REDRIVE)
+            to_describe.extend(arn for arn in finished if arn not in statuses)
+        if to_describe:
+            statuses.update(self.describe(to_describe))
+        return statuses
+
+    def wait_all(self, execution_arns, timeout=None):
+        """Yields the ExecutionStatus of each execution as it completes
+
+        :param timeout: seconds after which TimeoutError is raised if executions are still running
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        pending = set(execution_arns)
+        start_dates = {}
+        interval = self.min_interval
+        while pending:
+            statuses = self.poll(pending, start_dates)
+            completed = [
+                execution
+                for execution_arn, execution in statuses.items()
+                if execution_arn in pending and execution.status in self.terminal_statuses
+            ]
+            for execution in completed:
+                pending.discard(execution.execution_arn)
+                yield execution
+            if not pending:
+                break
+            interval = self.min_interval if completed else min(interval * 2, self.max_interval)
+            self._logger.debug(f"{len(pending)} executions pending, next poll in {interval} s ({self.api_calls} calls)")
+            if deadline:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"{len(pending)} executions still running after {timeout} s")
+                interval = min(interval, remaining)
+            time.sleep(interval)
+        self._logger.info(f"All executions completed, {self.api_calls} API calls")
 
 
 class StatesInterface:
+    # StartExecution rate limit shared by all the interfaces of the process, see start_rate_limiter
+    _start_rate_limiter = None
+    _start_rate_limiter_lock = threading.Lock()
+
     def __init__(self, log_level=None, states_client=None):
         self.log_level = log_level or os.getenv("LOG_LEVEL", "INFO")
         self._logger = init_logger(__name__, self.log_level)
-        stepfunctions_endpoint_url = "https://states." + os.getenv("AWS_REGION") + ".amazonaws.com"
-        session_config = Config(user_agent="awssdlf/2.11.0")
-        self._states_client = states_client or boto3.client(
-            "stepfunctions", endpoint_url=stepfunctions_endpoint_url, config=session_config
-        )
+        self._states_client = states_client or get_client("stepfunctions", endpoint_url=regional_endpoint("states"))
+
+    @classmethod
+    def start_rate_limiter(cls):
+        """Returns the token bucket limiting the StartExecution calls of the process to the SDLF_SFN_START_RATE env
+        variable (default 100) per second. The account quota is higher but shared with the other stages.
+        """
+        if cls._start_rate_limiter is None:
+            with cls._start_rate_limiter_lock:
+                if cls._start_rate_limiter is None:
+                    cls._start_rate_limiter = TokenBucket(float(os.getenv("SDLF_SFN_START_RATE", "100")))
+        return cls._start_rate_limiter
 
     @staticmethod
     def json_serial(obj):
@@ -33,11 +206,100 @@ class StatesInterface:
             step_functions.extend(result["stateMachines"])
         return step_functions
 
-    def run_state_machine(self, machine_arn, message):
+    def run_state_machine(self, machine_arn, message, claim_check=None):
+        """Starts an execution of machine_arn with message as input
+
+        :param claim_check: ClaimCheck storing message in S3 when its input is larger than the threshold, the
+            execution then gets the pointer as input
+        """
         self._logger.info("running state machine with arn {}".format(machine_arn))
-        return self._states_client.start_execution(
-            stateMachineArn=machine_arn, input=json.dumps(message, default=self.json_serial)
+        execution_input = json.dumps(message, default=self.json_serial)
+        if claim_check and len(execution_input.encode("utf-8")) > claim_check.threshold:
+            execution_input = json.dumps(claim_check.store(message), default=self.json_serial)
+        return self._states_client.start_execution(stateMachineArn=machine_arn, input=execution_input)
+
+    def start_executions(
+        self,
+        machine_arn,
+        inputs,
+        *,
+        names=None,
+        max_workers=None,
+        rate_limiter=None,
+        max_retries=8,
+        raise_on_failure=True,
+    ):
+        """Starts an execution of machine_arn per input, concurrently and within the StartExecution rate limit
+
+        Executions are named after a hash of the state machine and input unless names are given. Starting the same
+        name again does not start a second execution, its ARN is returned with already_started set instead.
+        :param inputs: execution inputs, serialised to JSON the same way as run_state_machine's message
+        :param names: execution names, one per input, e.g. the ids of the messages the inputs come from. An input
+            repeated under the same name is started once, different inputs with the same name raise ValueError
+        :param max_workers: number of concurrent StartExecution calls, defaults to the SDLF_SFN_START_WORKERS env
+            variable or 8
+        :param rate_limiter: TokenBucket the calls take a token from, defaults to start_rate_limiter()
+        :param max_retries: number of retries of a throttled call
+        :param raise_on_failure: raise ExecutionStartFailedException listing the inputs that could not be started
+        :return: an ExecutionStart per input, in the order of inputs
+        """
+        rate_limiter = rate_limiter or self.start_rate_limiter()
+        executions = {}
+        execution_names = []
+        for index, message in enumerate(inputs):
+            execution_input = json.dumps(message, default=self.json_serial)
+            name = (
+                names[index]
+                if names
+                else hashlib.sha256(f"{machine_arn}\n{execution_input}".encode("utf-8")).hexdigest()[:64]
+            )
+            execution_names.append(name)
+            if executions.setdefault(name, execution_input) != execution_input:
+                # only one of the inputs would be started, the other would be reported as already started
+                raise ValueError(f"Execution name {name} is given to different inputs")
+
+        def start(execution):
+            name, execution_input = execution
+            return name, self._start_execution(machine_arn, name, execution_input, rate_limiter, max_retries)
+
+        max_workers = max_workers or int(os.getenv("SDLF_SFN_START_WORKERS", "8"))
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = dict(executor.map(start, executions.items()))
+        results = [results[name] for name in execution_names]
+        failed = {index: result.error for index, result in enumerate(results) if result.error}
+        self._logger.info(
+            f"Started {len(executions) - len(failed)} executions of {machine_arn} in "
+            f"{time.perf_counter() - start_time:.2f} s, {sum(result.already_started for result in results)} "
+            f"already started, {len(failed)} failed"
         )
+        if failed and raise_on_failure:
+            self._logger.error("Execution start failed")
+            raise ExecutionStartFailedException(json.dumps(failed))
+        return results
+
+    def _start_execution(self, machine_arn, name, execution_input, rate_limiter, max_retries):
+        for attempt in range(max_retries + 1):
+            rate_limiter.acquire()
+            try:
+                response = self._states_client.start_execution(
+                    stateMachineArn=machine_arn, name=name, input=execution_input
+                )
+                return ExecutionStart(name, response["executionArn"])
+            except ClientError as e:
+                error_code = e.response["Error"]["Code"]
+                if error_code == "ExecutionAlreadyExists":
+                    execution_arn = f"{machine_arn.replace(':stateMachine:', ':execution:', 1)}:{name}"
+                    return ExecutionStart(name, execution_arn, already_started=True)
+                if error_code not in THROTTLING_ERROR_CODES or attempt == max_retries:
+                    self._logger.error("Error starting execution %s: %s", name, e)
+                    return ExecutionStart(name, None, error=error_code)
+                rate_limiter.empty()
+                time.sleep(backoff_delay(attempt))
+
+    def execution_tracker(self, **kwargs):
+        """Returns an ExecutionTracker using the client of the interface, see ExecutionTracker for the arguments"""
+        return ExecutionTracker(self._states_client, log_level=self.log_level, **kwargs)
 
     def describe_state_execution(self, execution_arn):
         self._logger.info("describing {}".format(execution_arn))
@@ -1,18 +1,46 @@
 # ruff: noqa: F401
+import importlib
 import logging
 
 from .__version__ import __title__, __version__
-from .config import (  # noqa: F401;
-    DynamoConfiguration,
-    KMSConfiguration,
-    S3Configuration,
-    SQSConfiguration,
-    StateMachineConfiguration,
-)
-from .peh import PipelineExecutionHistoryAPI
 
 name = "sdlf"
 
+# Public names and the submodule defining them. Submodules (and boto3 with them) are only imported when one of
+# their names is first accessed (PEP 562), modules using a single class don't pay for the others on cold starts
+_LAZY_ATTRIBUTES = {
+    "AdaptiveAggregationPolicy": "aggregator",
+    "AggregationPolicy": "aggregator",
+    "DurationModel": "aggregator",
+    "InMemoryBuffer": "aggregator",
+    "MicroBatchAggregator": "aggregator",
+    "SQSBuffer": "aggregator",
+    "aggregation_policy_from_env": "aggregator",
+    "aggregator_from_env": "aggregator",
+    "DynamoConfiguration": "config",
+    "KMSConfiguration": "config",
+    "S3Configuration": "config",
+    "SQSConfiguration": "config",
+    "SSMParameterCache": "config",
+    "StateMachineConfiguration": "config",
+    "ssm_parameters": "config",
+    "PipelineExecutionHistoryAPI": "peh",
+}
+
+
+def __getattr__(attribute):
+    module_name = _LAZY_ATTRIBUTES.get(attribute)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {attribute!r}")
+    value = getattr(importlib.import_module(f".{module_name}", __name__), attribute)
+    globals()[attribute] = value  # later accesses don't go through __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
+
+
 # Suppress boto3 logging
 logging.getLogger("boto3").setLevel(logging.CRITICAL)
 logging.getLogger("botocore").setLevel(logging.CRITICAL)
@@ -0,0 +1,373 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import NamedTuple, Optional
+
+from ..claim_check import rehydrate
+from ..commons import init_logger
+from ..interfaces.sqs_interface import SQSInterface
+
+
+class BufferStats(NamedTuple):
+    """Records waiting in a buffer. size (bytes) and oldest_age (seconds) are None when the buffer can't tell"""
+
+    count: int
+    size: Optional[int] = None
+    oldest_age: Optional[float] = None
+
+
+class AggregationPolicy:
+    """When buffered records of a stage are flushed into one state machine execution
+
+    Records are flushed once there are at least min_records of them, and either max_records of them, max_bytes of
+    them, or the oldest one has waited max_wait seconds. A flush takes at most max_records records and max_bytes.
+    With the defaults (max_wait 0) every routing invocation flushes what is there, up to 100 records.
+    """
+
+    def __init__(self, min_records=1, max_records=100, max_bytes=None, max_wait=0):
+        self.min_records = min_records
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.max_wait = max_wait
+
+    @classmethod
+    def from_config(cls, pipeline_config=None):
+        """Builds the policy of a stage from its pipeline configuration, over the SDLF_AGGREGATION_* env variables
+
+        :param pipeline_config: mapping with min_items_process, max_items_process, max_bytes_process and
+            max_wait_seconds keys, e.g. the pipeline entry of the pipelines table
+        """
+        pipeline_config = pipeline_config or {}
+
+        def setting(key, env_variable, default):
+            value = pipeline_config.get(key, os.getenv(env_variable))
+            return int(value) if value not in (None, "") else default
+
+        return cls(
+            min_records=setting("min_items_process", "SDLF_AGGREGATION_MIN_RECORDS", 1),
+            max_records=setting("max_items_process", "SDLF_AGGREGATION_MAX_RECORDS", 100),
+            max_bytes=setting("max_bytes_process", "SDLF_AGGREGATION_MAX_BYTES", None),
+            max_wait=setting("max_wait_seconds", "SDLF_AGGREGATION_MAX_WAIT", 0),
+        )
+
+    def flush_reason(self, stats):
+        """Returns why records with these stats should be flushed, None if they should keep waiting"""
+        if stats.count < self.min_records or stats.count == 0:
+            return None
+        if stats.count >= self.max_records:
+            return f"{stats.count} records >= max_records {self.max_records}"
+        if self.max_bytes and stats.size is not None and stats.size >= self.max_bytes:
+            return f"{stats.size} bytes >= max_bytes {self.max_bytes}"
+        if not self.max_wait:
+            return f"{stats.count} records >= min_records {self.min_records}"
+        if stats.oldest_age is not None and stats.oldest_age >= self.max_wait:
+            return f"oldest record waited {stats.oldest_age:.0f} s >= max_wait {self.max_wait}"
+        return None
+
+    def plan(self, stats):
+        """Returns (reason, number of records to flush), reason is None if the records should keep waiting"""
+        return self.flush_reason(stats), self.max_records
+
+    def __repr__(self):
+        return (
+            f"AggregationPolicy(min_records={self.min_records}, max_records={self.max_records}, "
+            f"max_bytes={self.max_bytes}, max_wait={self.max_wait})"
+        )
+
+
+class DurationModel(NamedTuple):
+    """Execution duration estimated as fixed + per_item * item_count, from past executions"""
+
+    fixed: float
+    per_item: float
+    executions: int
+
+    @classmethod
+    def fit(cls, durations):
+        """Least squares fit of (item_count, duration_in_seconds) pairs, None without any usable pair
+
+        With a single distinct item count, the fixed cost can't be told apart and is left at 0.
+        """
+        durations = [(count, duration) for count, duration in durations if count > 0]
+        if not durations:
+            return None
+        n = len(durations)
+        mean_count = sum(count for count, _ in durations) / n
+        mean_duration = sum(duration for _, duration in durations) / n
+        variance = sum((count - mean_count) ** 2 for count, _ in durations)
+        if variance:
+            per_item = (
+                sum((count - mean_count) * (duration - mean_duration) for count, duration in durations) / variance
+            )
+            fixed = mean_duration - per_item * mean_count
+            if per_item > 0 and fixed >= 0:
+                return cls(fixed, per_item, n)
+        # noisy or flat history: all the time is attributed to the items
+        return cls(0.0, mean_duration / mean_count, n)
+
+    def duration(self, item_count):
+        return self.fixed + self.per_item * item_count
+
+
+class AdaptiveAggregationPolicy(AggregationPolicy):
+    """Sizes batches so that records are processed within target_latency seconds of being buffered, using the
+    durations of past executions of the stage (see PipelineExecutionHistoryAPI.get_execution_durations)
+
+    Records are flushed:
+    - once there are enough of them for the fixed cost of an execution to be at most max_overhead of its duration,
+    - or when waiting check_interval more seconds (until the next routing run) would miss the target latency.
+    A flush takes as many records as can be processed within what is left of the target latency of the oldest one,
+    but never fewer than the efficient size nor more than max_records. Without history, it behaves like
+    AggregationPolicy with max_wait = target_latency.
+    """
+
+    def __init__(
+        self,
+        target_latency,
+        model=None,
+        *,
+        min_records=1,
+        max_records=100,
+        max_bytes=None,
+        max_overhead=0.2,
+        check_interval=0,
+    ):
+        """
+        :param target_latency: seconds between a record being buffered and the end of its processing
+        :param model: DurationModel of the stage executions, None if unknown
+        :param max_overhead: share of an execution duration the fixed cost may take in an efficient batch
+        :param check_interval: seconds between two routing runs, e.g. the schedule of the stage
+        """
+        super().__init__(min_records=min_records, max_records=max_records, max_bytes=max_bytes, max_wait=target_latency)
+        self.target_latency = target_latency
+        self.model = model
+        self.max_overhead = max_overhead
+        self.check_interval = check_interval
+
+    @classmethod
+    def from_history(cls, durations, target_latency, pipeline_config=None, **kwargs):
+        """Builds the policy of a stage from its past executions and its configuration (see from_config)
+
+        :param durations: (item_count, duration_in_seconds) of past executions
+        """
+        policy = AggregationPolicy.from_config(pipeline_config)
+        return cls(
+            target_latency,
+            DurationModel.fit(durations),
+            min_records=policy.min_records,
+            max_records=policy.max_records,
+            max_bytes=policy.max_bytes,
+            **kwargs,
+        )
+
+    @property
+    def efficient_records(self):
+        """Smallest batch whose fixed cost is at most max_overhead of the execution duration"""
+        if not self.model or not self.model.fixed:
+            return self.min_records
+        efficient = self.model.fixed * (1 - self.max_overhead) / (self.max_overhead * self.model.per_item)
+        return min(self.max_records, max(self.min_records, math.ceil(efficient)))
+
+    def plan(self, stats):
+        if not self.model:
+            return self.flush_reason(stats), self.max_records
+        if stats.count < self.min_records or stats.count == 0:
+            return None, 0
+        efficient = self.efficient_records
+        age = stats.oldest_age or 0
+        # records that can be processed within what is left of the target latency of the oldest record
+        budget = self.target_latency - age
+        within_target = max(0, math.floor((budget - self.model.fixed) / self.model.per_item))
+        size = min(self.max_records, max(efficient, within_target))
+        expected = self.model.duration(min(size, stats.count))
+        estimate = (
+            f"efficient size {efficient}, {within_target} records within target, "
+            f"{expected:.0f} s expected ({self.model.fixed:.1f} s + {self.model.per_item:.2f} s/record)"
+        )
+        if stats.count >= efficient:
+            return f"{stats.count} records >= efficient size, {estimate}", size
+        if self.max_bytes and stats.size is not None and stats.size >= self.max_bytes:
+            return f"{stats.size} bytes >= max_bytes {self.max_bytes}, {estimate}", size
+        if age + self.check_interval + expected >= self.target_latency:
+            return f"oldest record waited {age:.0f} s, target latency {self.target_latency} s, {estimate}", size
+        return None, size
+
+    def __repr__(self):
+        return (
+            f"AdaptiveAggregationPolicy(target_latency={self.target_latency}, model={self.model}, "
+            f"min_records={self.min_records}, max_records={self.max_records}, max_bytes={self.max_bytes}, "
+            f"max_overhead={self.max_overhead}, check_interval={self.check_interval})"
+        )
+
+
+class InMemoryBuffer:
+    """Buffer held by the process, records survive across warm invocations only. Meant for local runs and tests"""
+
+    def __init__(self):
+        self._records = {}  # key -> deque of (timestamp, size, record)
+        self._lock = threading.Lock()
+
+    def add(self, key, records):
+        now = time.time()
+        with self._lock:
+            buffered = self._records.setdefault(key, deque())
+            buffered.extend((now, len(json.dumps(record)), record) for record in records)
+
+    def stats(self, key, oldest_age=True):
+        with self._lock:
+            buffered = self._records.get(key) or ()
+            if not buffered:
+                return BufferStats(0, 0, None)
+            return BufferStats(len(buffered), sum(size for _, size, _ in buffered), time.time() - buffered[0][0])
+
+    def take(self, key, max_records, max_bytes=None):
+        records, taken_bytes = [], 0
+        with self._lock:
+            buffered = self._records.get(key) or deque()
+            while buffered and len(records) < max_records:
+                size = buffered[0][1]
+                if max_bytes and records and taken_bytes + size > max_bytes:
+                    break
+                records.append(buffered.popleft()[2])
+                taken_bytes += size
+        return records
+
+
+class SQSBuffer:
+    """Buffer backed by a FIFO queue dedicated to one stage, e.g. the stage queue in event-schedule mode
+
+    Depth and age are those of the whole queue, so the buffer holds the records of a single key and refuses any
+    other. The key is used as message group. Its size is unknown and the age of its oldest record comes from
+    CloudWatch, best effort.
+    """
+
+    def __init__(self, queue_interface, key, cloudwatch_client=None):
+        """
+        :param queue_interface: SQSInterface of the queue
+        :param key: the only key buffered in the queue
+        """
+        self._queue = queue_interface
+        self.key = key
+        self._cloudwatch_client = cloudwatch_client
+
+    def _check_key(self, key):
+        if key != self.key:
+            raise ValueError(f"SQSBuffer of {self.key} can't buffer records of {key}, use one queue per key")
+
+    def add(self, key, records):
+        self._check_key(key)
+        self._queue.send_batch_messages_to_fifo_queue(records, 10, key)
+
+    def stats(self, key, oldest_age=True):
+        """:param oldest_age: read the age of the oldest record, one more API call"""
+        self._check_key(key)
+        available, _ = self._queue.get_queue_depth()
+        age = self._queue.get_oldest_message_age(self._cloudwatch_client) if available and oldest_age else None
+        return BufferStats(available, None, age)
+
+    def take(self, key, max_records, max_bytes=None):
+        self._check_key(key)
+        records, taken_bytes, overflow = [], 0, []
+        for message in self._queue.drain(max_records):
+            body = rehydrate(message["Body"])
+            if max_bytes and records and taken_bytes + len(body) > max_bytes:
+                overflow.append(body)
+                continue
+            records.append(json.loads(body))
+            taken_bytes += len(body)
+        if overflow:
+            # received beyond max_bytes: buffered again for the next flush, under a new message group as FIFO
+            # deduplication would drop copies of messages sent less than 5 minutes ago
+            self._queue.send_batch_messages_to_fifo_queue(overflow, 10, f"{key}-{time.time_ns()}")
+        return records
+
+
+class MicroBatchAggregator:
+    """Buffers the records of a stage across routing invocations and releases them in batches sized by policy
+
+    buffer is any object with add(key, records), stats(key, oldest_age) and take(key, max_records, max_bytes) methods,
+    such as InMemoryBuffer or SQSBuffer. Keys identify the stage, e.g. "<dataset>-<stage>".
+    """
+
+    def __init__(self, buffer, policy=None, log_level=None):
+        self.log_level = log_level or os.getenv("LOG_LEVEL", "INFO")
+        self._logger = init_logger(__name__, self.log_level)
+        self.buffer = buffer
+        self.policy = policy or AggregationPolicy.from_config()
+
+    def add(self, key, records):
+        """Buffers records, then returns the batch to process if the policy says so, an empty list otherwise"""
+        if records:
+            self.buffer.add(key, records)
+        return self.flush(key)
+
+    def flush(self, key, force=False):
+        """Returns the next batch of buffered records if the policy (or force) says so, an empty list otherwise"""
+        stats = self.buffer.stats(key, oldest_age=bool(self.policy.max_wait))
+        reason, size = self.policy.plan(stats)
+        if force:
+            reason, size = "forced", self.policy.max_records
+        if not reason:
+            self._logger.info(f"Buffering {key}: {stats}, {self.policy}")
+            return []
+        records = self.buffer.take(key, size, self.policy.max_bytes)
+        self._logger.info(f"Flushing {len(records)} records of {key} ({reason}), {stats}")
+        return records
+
+    def flush_stale(self, key):
+        """Returns the next batch of buffered records once the oldest one waited max_wait seconds, even below
+        min_records. Meant for scheduled runs: records buffered by add are otherwise only flushed when more arrive
+
+        Records whose age is unknown (SQSBuffer without CloudWatch data) are flushed.
+        """
+        stats = self.buffer.stats(key)
+        if not stats.count or (stats.oldest_age is not None and stats.oldest_age < self.policy.max_wait):
+            self._logger.info(f"Buffering {key}: {stats}, {self.policy}")
+            return []
+        records = self.buffer.take(key, self.policy.max_records, self.policy.max_bytes)
+        self._logger.info(f"Flushing {len(records)} records of {key} (scheduled flush of stale records), {stats}")
+        return records
+
+
+# records of event-triggered stages buffered with SDLF_AGGREGATION_BUFFER=memory, kept across warm invocations
+_memory_buffer = InMemoryBuffer()
+
+
+def aggregator_from_env(key):
+    """Aggregator of the records of an event-triggered stage across invocations, None unless SDLF_AGGREGATION_BUFFER
+    is set:
+    - sqs: buffered in the FIFO queue named by SDLF_AGGREGATION_QUEUE, dedicated to key. The aggregation-flush
+      schedule of the stage processes records left waiting once no more events arrive
+    - memory: buffered in the process, lost when the Lambda execution environment is recycled and out of reach of
+      scheduled flushes running in another one (local runs and tests only)
+    """
+    buffer_type = os.getenv("SDLF_AGGREGATION_BUFFER")
+    if buffer_type == "sqs":
+        return MicroBatchAggregator(SQSBuffer(SQSInterface(os.environ["SDLF_AGGREGATION_QUEUE"]), key))
+    if buffer_type == "memory":
+        return MicroBatchAggregator(_memory_buffer)
+    return None
+
+
+def aggregation_policy_from_env(pipeline_execution, pipeline_name, pipeline_config=None):
+    """Adaptive policy when SDLF_AGGREGATION_TARGET_LATENCY is set, sized from the durations of the previous
+    executions of the pipeline stage. Fixed thresholds (see AggregationPolicy.from_config) otherwise
+
+    :param pipeline_execution: PipelineExecutionHistoryAPI of the stage
+    """
+    target_latency = int(os.getenv("SDLF_AGGREGATION_TARGET_LATENCY", "0"))
+    if not target_latency:
+        return AggregationPolicy.from_config(pipeline_config)
+    durations = pipeline_execution.get_execution_durations(pipeline_name)
+    init_logger(__name__, os.getenv("LOG_LEVEL", "INFO")).info(
+        f"Sizing batches from {len(durations)} past executions of {pipeline_name}"
+    )
+    return AdaptiveAggregationPolicy.from_history(
+        durations,
+        target_latency,
+        pipeline_config,
+        check_interval=int(os.getenv("SDLF_AGGREGATION_CHECK_INTERVAL", "0")),
+    )
@@ -1,11 +1,91 @@
 import os
+import threading
+import time
 
-import boto3
 from botocore.exceptions import ClientError
 
+from ..clients import get_client, regional_endpoint
 from ..commons import init_logger
 
 
+class SSMParameterCache:
+    # GetParameters accepts at most 10 names per call
+    max_names_per_call = 10
+
+    def __init__(self, ssm_interface=None, ttl=None, log_level=None):
+        """
+        Caches SSM parameter values with a time to live, so that warm Lambda invocations don't hit Parameter Store again
+        :param ssm_interface: ssm interface, normally boto, to read parameters from parameter store
+        :param ttl: seconds a value is served from the cache, defaults to the SDLF_SSM_CACHE_TTL env variable or 300
+        :param log_level: level the class logger should log at
+        """
+        self.log_level = log_level or os.getenv("LOG_LEVEL", "INFO")
+        self._logger = init_logger(__name__, self.log_level)
+        self.ttl = ttl if ttl is not None else int(os.getenv("SDLF_SSM_CACHE_TTL", "300"))
+        self._ssm = ssm_interface
+        self._parameters = {}  # parameter name -> (value, expiry)
+        self._lock = threading.Lock()
+
+    @property
+    def ssm(self):
+        return self._ssm or get_client("ssm", endpoint_url=regional_endpoint("ssm"))
+
+    def _get_cached(self, name, now):
+        cached = self._parameters.get(name)
+        if cached and cached[1] > now:
+            return cached[0]
+        return None
+
+    def _store(self, parameters):
+        expiry = time.monotonic() + self.ttl
+        with self._lock:
+            for parameter in parameters:
+                self._parameters[parameter["Name"]] = (parameter["Value"], expiry)
+
+    def get(self, name):
+        return self.get_many([name])[name]
+
+    def get_many(self, names):
+        """Returns a {name: value} dict, fetching the names missing from the cache 10 at a time with GetParameters"""
+        now = time.monotonic()
+        values = {name: self._get_cached(name, now) for name in names}
+        missing = [name for name, value in values.items() if value is None]
+        for i in range(0, len(missing), self.max_names_per_call):
+            chunk = missing[i : i + self.max_names_per_call]
+            self._logger.debug(f"Obtaining SSM Parameters: {chunk}")
+            response = self.ssm.get_parameters(Names=chunk)
+            self._store(response["Parameters"])
+            values.update({parameter["Name"]: parameter["Value"] for parameter in response["Parameters"]})
+            for name in response.get("InvalidParameters", []):
+                # GetParameter raises the ParameterNotFound error callers have always dealt with
+                parameter = self.ssm.get_parameter(Name=name)["Parameter"]
+                self._store([parameter])
+                values[name] = parameter["Value"]
+        return values
+
+    def prefetch(self, path):
+        """Loads every parameter under path (e.g. /sdlf/storage) in as few GetParametersByPath calls as possible"""
+        self._logger.debug(f"Prefetching SSM Parameters under: {path}")
+        paginator = self.ssm.get_paginator("get_parameters_by_path")
+        for page in paginator.paginate(Path=path, Recursive=True):
+            self._store(page["Parameters"])
+
+    def invalidate(self, name=None):
+        with self._lock:
+            if name:
+                self._parameters.pop(name, None)
+            else:
+                self._parameters.clear()
+
+
+# Cache shared by all configuration classes of the process, it survives warm Lambda invocations
+ssm_parameters = SSMParameterCache()
+
+
+def _parameter_cache(ssm_interface):
+    return SSMParameterCache(ssm_interface=ssm_interface) if ssm_interface else ssm_parameters
+
+
 class S3Configuration:
     def __init__(
         self,
@@ -29,8 +109,7 @@ class S3Configuration:
         self.analytics_bucket_instance = analytics_bucket_instance or instance
         self.artifacts_bucket_instance = artifacts_bucket_instance or instance
 
-        ssm_endpoint_url = "https://ssm." + os.getenv("AWS_REGION") + ".amazonaws.com"
-        self._ssm = ssm_interface or boto3.client("ssm", endpoint_url=ssm_endpoint_url)
+        self._ssm_parameters = _parameter_cache(ssm_interface)
 
         # self._fetch_from_environment()
         self._fetch_from_ssm()
@@ -45,20 +124,16 @@ class S3Configuration:
         )
         try:
             raw_bucket_ssm = f"/sdlf/storage/rRawBucket/{self.raw_bucket_instance}"
-            self._logger.debug(f"Obtaining SSM Parameter: {raw_bucket_ssm}")
-            self.raw_bucket = self._ssm.get_parameter(Name=raw_bucket_ssm)["Parameter"]["Value"]
-
             stage_bucket_ssm = f"/sdlf/storage/rStageBucket/{self.stage_bucket_instance}"
-            self._logger.debug(f"Obtaining SSM Parameter: {stage_bucket_ssm}")
-            self.stage_bucket = self._ssm.get_parameter(Name=stage_bucket_ssm)["Parameter"]["Value"]
-
             analytics_bucket_ssm = f"/sdlf/storage/rAnalyticsBucket/{self.analytics_bucket_instance}"
-            self._logger.debug(f"Obtaining SSM Parameter: {analytics_bucket_ssm}")
-            self.analytics_bucket = self._ssm.get_parameter(Name=analytics_bucket_ssm)["Parameter"]["Value"]
-
             artifacts_bucket_ssm = f"/sdlf/storage/rArtifactsBucket/{self.artifacts_bucket_instance}"
-            self._logger.debug(f"Obtaining SSM Parameter: {artifacts_bucket_ssm}")
-            self.artifacts_bucket = self._ssm.get_parameter(Name=artifacts_bucket_ssm)["Parameter"]["Value"]
+            parameters = self._ssm_parameters.get_many(
+                [raw_bucket_ssm, stage_bucket_ssm, analytics_bucket_ssm, artifacts_bucket_ssm]
+            )
+            self.raw_bucket = parameters[raw_bucket_ssm]
+            self.stage_bucket = parameters[stage_bucket_ssm]
+            self.analytics_bucket = parameters[analytics_bucket_ssm]
+            self.artifacts_bucket = parameters[artifacts_bucket_ssm]
         except ClientError as e:
             if e.response["Error"]["Code"] == "ThrottlingException":
                 self._logger.error("SSM RATE LIMIT REACHED")
@@ -86,8 +161,7 @@ class DynamoConfiguration:
         self.peh_table_instance = peh_table_instance or instance
         self.manifests_table_instance = manifests_table_instance or instance
 
-        ssm_endpoint_url = "https://ssm." + os.getenv("AWS_REGION") + ".amazonaws.com"
-        self._ssm = ssm_interface or boto3.client("ssm", endpoint_url=ssm_endpoint_url)
+        self._ssm_parameters = _parameter_cache(ssm_interface)
 
         self._fetch_from_ssm()
 
@@ -97,12 +171,10 @@ class DynamoConfiguration:
         )
         try:
             peh_table_ssm = f"/sdlf/dataset/rDynamoPipelineExecutionHistory/{self.peh_table_instance}"
-            self._logger.debug(f"Obtaining SSM Parameter: {peh_table_ssm}")
-            self.peh_table = self._ssm.get_parameter(Name=peh_table_ssm)["Parameter"]["Value"]
-
             manifests_table_ssm = f"/sdlf/dataset/rDynamoManifests/{self.manifests_table_instance}"
-            self._logger.debug(f"Obtaining SSM Parameter: {manifests_table_ssm}")
-            self.manifests_table = self._ssm.get_parameter(Name=manifests_table_ssm)["Parameter"]["Value"]
+            parameters = self._ssm_parameters.get_many([peh_table_ssm, manifests_table_ssm])
+            self.peh_table = parameters[peh_table_ssm]
+            self.manifests_table = parameters[manifests_table_ssm]
         except ClientError as e:
             if e.response["Error"]["Code"] == "ThrottlingException":
                 self._logger.error("SSM RATE LIMIT REACHED")
@@ -122,8 +194,7 @@ class SQSConfiguration:
         self._logger = init_logger(__name__, self.log_level)
         self.stage_queue_instance = instance
 
-        ssm_endpoint_url = "https://ssm." + os.getenv("AWS_REGION") + ".amazonaws.com"
-        self._ssm = ssm_interface or boto3.client("ssm", endpoint_url=ssm_endpoint_url)
+        self._ssm_parameters = _parameter_cache(ssm_interface)
 
         self._fetch_from_ssm()
 
@@ -133,12 +204,10 @@ class SQSConfiguration:
         )
         try:
             stage_queue_ssm = f"/sdlf/pipeline/rQueueRoutingStep/{self.stage_queue_instance}"
-            self._logger.debug(f"Obtaining SSM Parameter: {stage_queue_ssm}")
-            self.stage_queue = self._ssm.get_parameter(Name=stage_queue_ssm)["Parameter"]["Value"]
-
             stage_dlq_ssm = f"/sdlf/pipeline/rDeadLetterQueueRoutingStep/{self.stage_queue_instance}"
-            self._logger.debug(f"Obtaining SSM Parameter: {stage_dlq_ssm}")
-            self.stage_dlq = self._ssm.get_parameter(Name=stage_dlq_ssm)["Parameter"]["Value"]
+            parameters = self._ssm_parameters.get_many([stage_queue_ssm, stage_dlq_ssm])
+            self.stage_queue = parameters[stage_queue_ssm]
+            self.stage_dlq = parameters[stage_dlq_ssm]
         except ClientError as e:
             if e.response["Error"]["Code"] == "ThrottlingException":
                 self._logger.error("SSM RATE LIMIT REACHED")
@@ -158,8 +227,7 @@ class StateMachineConfiguration:
         self._logger = init_logger(__name__, self.log_level)
         self.stage_state_machine_instance = instance
 
-        ssm_endpoint_url = "https://ssm." + os.getenv("AWS_REGION") + ".amazonaws.com"
-        self._ssm = ssm_interface or boto3.client("ssm", endpoint_url=ssm_endpoint_url)
+        self._ssm_parameters = _parameter_cache(ssm_interface)
 
         self._fetch_from_ssm()
 
@@ -169,8 +237,7 @@ class StateMachineConfiguration:
         )
         try:
             stage_state_machine_ssm = f"/sdlf/pipeline/rStateMachine/{self.stage_state_machine_instance}"
-            self._logger.debug(f"Obtaining SSM Parameter: {stage_state_machine_ssm}")
-            self.stage_state_machine = self._ssm.get_parameter(Name=stage_state_machine_ssm)["Parameter"]["Value"]
+            self.stage_state_machine = self._ssm_parameters.get(stage_state_machine_ssm)
         except ClientError as e:
             if e.response["Error"]["Code"] == "ThrottlingException":
                 self._logger.error("SSM RATE LIMIT REACHED")
@@ -190,8 +257,7 @@ class KMSConfiguration:
         self._logger = init_logger(__name__, self.log_level)
         self.data_kms_key_instance = instance
 
-        ssm_endpoint_url = "https://ssm." + os.getenv("AWS_REGION") + ".amazonaws.com"
-        self._ssm = ssm_interface or boto3.client("ssm", endpoint_url=ssm_endpoint_url)
+        self._ssm_parameters = _parameter_cache(ssm_interface)
 
         self._fetch_from_ssm()
 
@@ -201,8 +267,7 @@ class KMSConfiguration:
         )
         try:
             data_kms_key_ssm = f"/sdlf/dataset/rKMSDataKey/{self.data_kms_key_instance}"
-            self._logger.debug(f"Obtaining SSM Parameter: {data_kms_key_ssm}")
-            self.data_kms_key = self._ssm.get_parameter(Name=data_kms_key_ssm)["Parameter"]["Value"]
+            self.data_kms_key = self._ssm_parameters.get(data_kms_key_ssm)
         except ClientError as e:
             if e.response["Error"]["Code"] == "ThrottlingException":
                 self._logger.error("SSM RATE LIMIT REACHED")
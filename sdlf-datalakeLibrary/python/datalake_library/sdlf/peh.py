@@ -3,11 +3,13 @@ import logging
 import os
 import uuid
 from decimal import Decimal
+from typing import NamedTuple
 
 import boto3
-from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
 
-from ..commons import deserialize_dynamodb_item, serialize_dynamodb_item
+from ..clients import get_client, regional_endpoint
+from ..commons import deserialize_dynamodb_item, deserialize_dynamodb_items, serialize_dynamodb_item
 from .config import DynamoConfiguration
 from .utils import (
     get_duration_sec,
@@ -26,10 +28,19 @@ PEH_STATUS_STARTED = "STARTED"
 PEH_STATUS_COMPLETED = "COMPLETED"
 PEH_STATUS_FAILED = "FAILED"
 PEH_STATUS_CANCELED = "CANCELED"
+PEH_END_STATUSES = [PEH_STATUS_COMPLETED, PEH_STATUS_CANCELED, PEH_STATUS_FAILED]
+
+
+class ExecutionDuration(NamedTuple):
+    item_count: int
+    duration_in_seconds: float
 
 
 class PipelineExecutionHistoryAPI:
     pipelines = dict()  # Pipelines cache across all instances
+    _account_id = None  # Account of the process credentials, resolved on first use
+    _dynamo_configs = dict()  # DynamoConfiguration per (peh_table_instance, manifests_table_instance)
+    max_update_attempts = 3  # Conditional updates retried when the record was changed by another writer
 
     def __init__(
         self,
@@ -41,12 +52,9 @@ class PipelineExecutionHistoryAPI:
         manifests_table_instance=None,
         sns_topic: str = None,
     ):
-        self.dynamodb = boto3.client("dynamodb")
-        dynamo_config = DynamoConfiguration(
-            peh_table_instance=peh_table_instance,
-            manifests_table_instance=manifests_table_instance,
-        )
-        self.peh_table = dynamo_config.peh_table
+        self.peh_table_instance = peh_table_instance
+        self.manifests_table_instance = manifests_table_instance
+        self._peh_table = None
         self.peh_ttl = 120  # TODO property of dynamo_config?
 
         self._logger = logging.getLogger(__name__)
@@ -60,6 +68,8 @@ class PipelineExecutionHistoryAPI:
         # No current pipeline execution
         self.pipeline_name = None
         self.pipeline_execution_id = None
+        self._cache_peh_record(None)
+        self._buffered_events = None  # list of pending updates in buffered mode
 
         if self.run_in_fargate:
             if "AWS_ACCESS_KEY" in os.environ and "AWS_SECRET_ACCESS_KEY" in os.environ:
@@ -80,8 +90,34 @@ class PipelineExecutionHistoryAPI:
         else:
             boto3.setup_default_session(profile_name=self.profile, region_name=self.region)
 
-        sts_endpoint_url = "https://sts." + os.getenv("AWS_REGION") + ".amazonaws.com"
-        self.account_id = boto3.client("sts", endpoint_url=sts_endpoint_url).get_caller_identity().get("Account")
+        self.dynamodb = get_client("dynamodb")
+
+    @property
+    def account_id(self):
+        if PipelineExecutionHistoryAPI._account_id is None:
+            sts = get_client("sts", endpoint_url=regional_endpoint("sts"))
+            PipelineExecutionHistoryAPI._account_id = sts.get_caller_identity().get("Account")
+        return PipelineExecutionHistoryAPI._account_id
+
+    @property
+    def peh_table(self):
+        """Name of the pipeline execution history table, read from SSM the first time a record is accessed"""
+        if self._peh_table is None:
+            self._peh_table = self._get_dynamo_config().peh_table
+        return self._peh_table
+
+    @peh_table.setter
+    def peh_table(self, peh_table):
+        self._peh_table = peh_table
+
+    def _get_dynamo_config(self):
+        key = (self.peh_table_instance, self.manifests_table_instance)
+        if key not in PipelineExecutionHistoryAPI._dynamo_configs:
+            PipelineExecutionHistoryAPI._dynamo_configs[key] = DynamoConfiguration(
+                peh_table_instance=self.peh_table_instance,
+                manifests_table_instance=self.manifests_table_instance,
+            )
+        return PipelineExecutionHistoryAPI._dynamo_configs[key]
 
     def start_pipeline_execution(
         self, pipeline_name: str, dataset_name: str = None, dataset_date: str = None, comment: str = None
@@ -143,19 +179,26 @@ class PipelineExecutionHistoryAPI:
 
         if self.peh_ttl > 0:
             item["ttl"] = get_ttl(self.peh_ttl)
-        serializer = TypeSerializer()
-        self.dynamodb.put_item(TableName=self.peh_table, Item=serialize_dynamodb_item(item, serializer))
+        self.dynamodb.put_item(TableName=self.peh_table, Item=serialize_dynamodb_item(item))
 
         self.set_pipeline_execution(peh_id, pipeline_name)
+        self._cache_peh_record(item)
 
         return peh_id
 
-    def update_pipeline_execution(self, status: str, component: str = None, issue_comment: str = None):
+    def update_pipeline_execution(
+        self, status: str, component: str = None, issue_comment: str = None, item_count: int = None
+    ):
         """Update status of Pipeline Execution History record
 
+        The record is updated with a single conditional UpdateItem, based on the version and start timestamp cached
+        when the execution was started or retrieved. It is only read again if another writer updated it in between.
+        In buffered mode (see __enter__), the update is only recorded and written when the buffer is flushed.
+
         Arguments:
             status {str} -- New status of Pipeline Execution
             component {str} -- Optional. Component of Pipeline Execution
+            item_count {int} -- Optional. Number of items processed by the execution, see get_execution_durations
 
         Returns:
             bool -- True if successful
@@ -163,113 +206,162 @@ class PipelineExecutionHistoryAPI:
         self._logger.debug("peh create_execution() called")
 
         throw_if_false(self.is_pipeline_set(), "Pipeline execution is not yet assigned")
-        peh_id = self.pipeline_execution_id
-
-        peh_rec = self.get_peh_record(peh_id)
-        if peh_rec:
-            is_active = peh_rec["active"]
-        else:
-            is_active = False
-        throw_if_false(is_active, "Pipeline execution is not active")
 
-        version = peh_rec["version"]
-        start_time = peh_rec["start_timestamp"]
+        if self._peh_version is None:
+            self._cache_peh_record(self.get_peh_record(self.pipeline_execution_id))
 
         current_time = datetime.datetime.now(datetime.UTC)
-        utc_time_iso = get_timestamp_iso(current_time)
-        # local_date_iso = get_local_date()
-
-        if status in [PEH_STATUS_COMPLETED, PEH_STATUS_CANCELED, PEH_STATUS_FAILED]:
-            duration_sec = get_duration_sec(start_time, utc_time_iso)
-
-            if status == PEH_STATUS_COMPLETED:
-                is_success = True
-            else:
-                is_success = False
-
-            expr_names = {
-                "#H": "history",
-                "#St": "status",
-                "#LUT": "last_updated_timestamp",
-                "#STT": "status_last_updated_timestamp",
-                "#A": "active",
-                "#V": "version",
-                "#ETS": "end_timestamp",
-                "#S": "success",
-                "#D": "duration_in_seconds",
-            }
-
-            if component:
-                history_list = [{"status": status, "timestamp": utc_time_iso, "component": component}]
+        event = {
+            "status": status,
+            "component": component,
+            "issue_comment": issue_comment,
+            "item_count": item_count,
+            "timestamp": get_timestamp_iso(current_time),
+        }
+        if self._buffered_events is not None:
+            ended = any(buffered["status"] in PEH_END_STATUSES for buffered in self._buffered_events)
+            throw_if_false(self._peh_active and not ended, "Pipeline execution is not active")
+            self._buffered_events.append(event)
+            return True
+
+        return self._write_events([event])
+
+    def _write_events(self, events):
+        peh_id = self.pipeline_execution_id
+        for attempt in range(self.max_update_attempts):
+            throw_if_false(self._peh_active, "Pipeline execution is not active")
+
+            update_expr, expr_names, expr_values = self._build_update(events)
+            expr_names["#A"] = "active"
+            expr_values[":ACTIVE"] = True
+
+            try:
+                self.dynamodb.update_item(
+                    TableName=self.peh_table,
+                    Key={"id": {"S": peh_id}},
+                    UpdateExpression=update_expr,
+                    ConditionExpression="#A = :ACTIVE AND #V = :V",
+                    ExpressionAttributeNames=expr_names,
+                    ExpressionAttributeValues=serialize_dynamodb_item(expr_values),
+                    ReturnValuesOnConditionCheckFailure="ALL_OLD",
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+                self._logger.debug(f"PEH record {peh_id} changed since last read (attempt {attempt + 1})")
+                # the failed condition returns the current item, a record missing altogether needs a read
+                if "Item" in e.response:
+                    self._cache_peh_record(deserialize_dynamodb_item(e.response["Item"]))
+                else:
+                    self._cache_peh_record(self.get_peh_record(peh_id))
+                continue
+
+            self._peh_version += 1
+            if events[-1]["status"] in PEH_END_STATUSES:
+                self._peh_active = False
+            return True
+
+        raise RuntimeError(f"Pipeline execution {peh_id} kept being updated concurrently")
+
+    def _build_update(self, events):
+        """Builds a single update expression appending all events to the history, the last one sets the status"""
+        history_list = []
+        for event in events:
+            if event["component"]:
+                history_list.append(
+                    {"status": event["status"], "timestamp": event["timestamp"], "component": event["component"]}
+                )
             else:
-                history_list = [{"status": status, "timestamp": utc_time_iso}]
-
-            expr_values = {
-                ":H": history_list,
-                ":St": status,
-                ":LUT": utc_time_iso,
-                ":STT": status + "#" + utc_time_iso,
-                ":INC": 1,
-                ":ETS": utc_time_iso,
-                ":A": False,
-                ":S": is_success,
-                ":V": version,
-                ":D": Decimal(str(duration_sec)),
-            }
-
-            update_expr = (
-                "SET #H = list_append(#H, :H), #S = :S, #V = :V + :INC,"
-                "#LUT = :LUT, #A = :A, #St = :St, #ETS = :ETS, #D = :D,"
-                "#STT = :STT"
+                history_list.append({"status": event["status"], "timestamp": event["timestamp"]})
+
+        last_event = events[-1]
+        utc_time_iso = last_event["timestamp"]
+        expr_names = {
+            "#H": "history",
+            "#St": "status",
+            "#V": "version",
+            "#LUT": "last_updated_timestamp",
+            "#STT": "status_last_updated_timestamp",
+        }
+        expr_values = {
+            ":H": history_list,
+            ":St": last_event["status"],
+            ":STT": last_event["status"] + "#" + utc_time_iso,
+            ":LUT": utc_time_iso,
+            ":INC": 1,
+            ":V": self._peh_version,
+        }
+        update_expr = "SET #H = list_append(#H, :H), #St = :St, #STT = :STT, #V = :V + :INC, #LUT = :LUT"
+
+        comments = [
+            event["issue_comment"]
+            for event in events
+            if event["status"] not in PEH_END_STATUSES and is_not_empty(event["issue_comment"])
+        ]
+        if comments:
+            expr_names["#C"] = "comment"
+            expr_values[":C"] = comments[-1]
+            update_expr += ", #C = :C"
+
+        item_counts = [event["item_count"] for event in events if event.get("item_count") is not None]
+        if item_counts:
+            expr_names["#IN"] = "item_count"
+            expr_values[":IN"] = item_counts[-1]
+            update_expr += ", #IN = :IN"
+
+        if last_event["status"] in PEH_END_STATUSES:
+            duration_sec = get_duration_sec(self._peh_start_timestamp, utc_time_iso)
+            expr_names.update({"#A": "active", "#ETS": "end_timestamp", "#S": "success", "#D": "duration_in_seconds"})
+            expr_values.update(
+                {
+                    ":A": False,
+                    ":ETS": utc_time_iso,
+                    ":S": last_event["status"] == PEH_STATUS_COMPLETED,
+                    ":D": Decimal(str(duration_sec)),
+                }
             )
-
-            if is_not_empty(issue_comment):
-                expr_names["#C"] = "issue_comment"
-                expr_values[":C"] = issue_comment
-                update_expr += ", #C = :C"
-
+            update_expr += ", #A = :A, #ETS = :ETS, #S = :S, #D = :D"
+
+            if is_not_empty(last_event["issue_comment"]):
+                expr_names["#IC"] = "issue_comment"
+                expr_values[":IC"] = last_event["issue_comment"]
+                update_expr += ", #IC = :IC"
+
+        return update_expr, expr_names, expr_values
+
+    def flush(self):
+        """Writes the events recorded in buffered mode as a single update of the PEH record"""
+        events, self._buffered_events = self._buffered_events, []
+        if events:
+            self._write_events(events)
+
+    def __enter__(self) -> "PipelineExecutionHistoryAPI":
+        """Buffered mode: updates and end_pipeline_execution_* calls made in the with block are merged into one
+        UpdateItem written when leaving the block, whether it exits normally or with an exception"""
+        self._buffered_events = []
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        try:
+            self.flush()
+        except Exception:
+            if exception_value is None:
+                raise
+            # don't mask the exception that interrupted the block
+            self._logger.exception("Error writing buffered pipeline execution updates")
+        finally:
+            self._buffered_events = None
+
+    def _cache_peh_record(self, peh_rec):
+        """Keeps what conditional updates need from a PEH record: whether it is active, its version and start time"""
+        if peh_rec:
+            self._peh_active = peh_rec["active"]
+            self._peh_version = peh_rec["version"]
+            self._peh_start_timestamp = peh_rec["start_timestamp"]
         else:
-            expr_names = {
-                "#H": "history",
-                "#St": "status",
-                "#V": "version",
-                "#LUT": "last_updated_timestamp",
-                "#STT": "status_last_updated_timestamp",
-            }
-
-            if component:
-                history_list = [{"status": status, "timestamp": utc_time_iso, "component": component}]
-            else:
-                history_list = [{"status": status, "timestamp": utc_time_iso}]
-
-            expr_values = {
-                ":H": history_list,
-                ":St": status,
-                ":STT": status + "#" + utc_time_iso,
-                ":LUT": utc_time_iso,
-                ":INC": 1,
-                ":V": version,
-            }
-            update_expr = "SET #H = list_append(#H, :H), #St = :St, #STT = :STT, #V = :V + :INC, #LUT = :LUT"
-
-            if is_not_empty(issue_comment):
-                expr_names["#C"] = "comment"
-                expr_values[":C"] = issue_comment
-                update_expr += ", #C = :C"
-
-        # self._logger.debug(f"Update: {update_expr} \nNames: {expr_names} \nValues{expr_values}")
-
-        serializer = TypeSerializer()
-        self.dynamodb.update_item(
-            TableName=self.peh_table,
-            Key={"id": {"S": peh_id}},
-            UpdateExpression=update_expr,
-            ExpressionAttributeNames=expr_names,
-            ExpressionAttributeValues=serialize_dynamodb_item(expr_values, serializer),
-            ReturnValues="UPDATED_NEW",
-        )
-
-        return True
+            self._peh_active = False
+            self._peh_version = None
+            self._peh_start_timestamp = None
 
     def get_peh_record(self, peh_id):
         # self._logger.debug(f"check_peh_active(): {peh_id}")
@@ -300,6 +392,7 @@ class PipelineExecutionHistoryAPI:
             raise ValueError("Pipeline execution is inactive")
 
         self.set_pipeline_execution(peh_id, item["pipeline"])
+        self._cache_peh_record(item)
 
     def end_pipeline_execution_failed(self, component: str = None, issue_comment: str = None) -> bool:
         """Closes Pipeline Execution History record with FAILED status
@@ -336,6 +429,47 @@ class PipelineExecutionHistoryAPI:
         """
         return self.update_pipeline_execution(PEH_STATUS_CANCELED, component=component, issue_comment=issue_comment)
 
+    def get_execution_durations(self, pipeline_name: str, max_executions: int = 20, max_pages: int = 5):
+        """Returns the (item_count, duration_in_seconds) of the latest successful executions of a pipeline
+
+        Only executions whose item count was recorded (see update_pipeline_execution) are returned, most recent
+        first. The pipeline-last-updated-index of the table is queried page by page, as runs that processed nothing
+        can outnumber the others, until max_executions are found or max_pages (up to 1 MB each) were read.
+
+        Arguments:
+            pipeline_name {str} -- Name of pipeline, as given to start_pipeline_execution
+            max_executions {int} -- Optional. Number of executions to return at most
+            max_pages {int} -- Optional. Number of Query calls to make at most
+
+        Returns:
+            list -- ExecutionDuration tuples
+        """
+        request = dict(
+            TableName=self.peh_table,
+            IndexName="pipeline-last-updated-index",
+            KeyConditionExpression="#P = :P",
+            FilterExpression="#S = :S AND attribute_exists(#IN)",
+            ProjectionExpression="#IN, #D",
+            ExpressionAttributeNames={
+                "#P": "pipeline",
+                "#S": "success",
+                "#IN": "item_count",
+                "#D": "duration_in_seconds",
+            },
+            ExpressionAttributeValues={":P": {"S": pipeline_name}, ":S": {"BOOL": True}},
+            ScanIndexForward=False,
+        )
+        durations = []
+        for _ in range(max_pages):
+            response = self.dynamodb.query(**request)
+            for item in deserialize_dynamodb_items(response["Items"]):
+                if item["item_count"] and item.get("duration_in_seconds") is not None:
+                    durations.append(ExecutionDuration(int(item["item_count"]), float(item["duration_in_seconds"])))
+            if len(durations) >= max_executions or "LastEvaluatedKey" not in response:
+                break
+            request["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        return durations[:max_executions]
+
     def is_pipeline_set(self) -> bool:
         """Check if current pipeline execution is set
 
@@ -348,6 +482,7 @@ class PipelineExecutionHistoryAPI:
         """Clears the current pipeline execution"""
         self.pipeline_execution_id = None
         self.pipeline_name = None
+        self._cache_peh_record(None)
 
     def set_pipeline_execution(self, pipeline_execution_id: str, pipeline_name: str):
         """Sets the current pipeline execution
@@ -356,5 +491,7 @@ class PipelineExecutionHistoryAPI:
             pipeline_execution_id {str} -- Unique identifier of pipeline execution
             pipeline_name {str} -- Pipeline name
         """
+        if pipeline_execution_id != self.pipeline_execution_id:
+            self._cache_peh_record(None)
         self.pipeline_execution_id = pipeline_execution_id
         self.pipeline_name = pipeline_name
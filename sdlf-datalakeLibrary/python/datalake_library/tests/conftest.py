@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+# the layer puts python/ on the path of the Lambda functions, tests import datalake_library the same way
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from datalake_library.clients import clients
+
+
+@pytest.fixture(autouse=True)
+def aws_environment(monkeypatch):
+    """Fake credentials and region so that tests never reach a real account, and no client shared between tests"""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_SESSION_TOKEN", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_REGION", "us-east-1")
+    clients.clear()
+    yield
+    clients.clear()
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    """Retries happen right away instead of after a backoff delay"""
+    for module in ("dynamo_interface", "sqs_interface", "states_interface"):
+        monkeypatch.setattr(f"datalake_library.interfaces.{module}.backoff_delay", lambda attempt: 0)
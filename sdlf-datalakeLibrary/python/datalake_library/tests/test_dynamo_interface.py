@@ -0,0 +1,107 @@
+from types import SimpleNamespace
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+from datalake_library.datalake_exceptions import UnprocessedKeysException
+from datalake_library.interfaces.dynamo_interface import DynamoInterface
+
+TABLE = "octagon-ObjectMetadata-dev"
+
+
+@pytest.fixture
+def dynamodb_client():
+    return boto3.client("dynamodb", region_name="us-east-1")
+
+
+@pytest.fixture
+def dynamo_interface(dynamodb_client, monkeypatch):
+    # a single request in flight, stubbed responses are consumed in order
+    monkeypatch.setenv("SDLF_BATCH_WRITE_WORKERS", "1")
+    monkeypatch.setenv("SDLF_BATCH_GET_WORKERS", "1")
+    configuration = SimpleNamespace(object_metadata_table=TABLE, manifests_control_table="manifests")
+    return DynamoInterface(configuration, dynamodb_client=dynamodb_client)
+
+
+def item(key):
+    return {"id": f"s3://bucket/{key}", "key": key}
+
+
+def serialized(key):
+    return {"id": {"S": f"s3://bucket/{key}"}, "key": {"S": key}}
+
+
+def write_request(*keys):
+    return {"RequestItems": {TABLE: [{"PutRequest": {"Item": serialized(key)}} for key in keys]}}
+
+
+def get_request(*keys):
+    return {
+        "RequestItems": {
+            TABLE: {"Keys": [{"id": {"S": f"s3://bucket/{key}"}} for key in keys], "ConsistentRead": False}
+        }
+    }
+
+
+def test_batch_write_retries_unprocessed_items(dynamo_interface, dynamodb_client, no_backoff):
+    with Stubber(dynamodb_client) as stubber:
+        unprocessed = write_request("b")["RequestItems"]
+        stubber.add_response("batch_write_item", {"UnprocessedItems": unprocessed}, write_request("a", "b"))
+        stubber.add_response("batch_write_item", {"UnprocessedItems": {}}, write_request("b"))
+        stats = dynamo_interface.batch_put_item_in_object_metadata_table([item("a"), item("b")])
+        stubber.assert_no_pending_responses()
+    assert (stats.items_written, stats.batches, stats.retries, stats.throttles) == (2, 2, 1, 0)
+
+
+def test_batch_write_retries_throttled_calls(dynamo_interface, dynamodb_client, no_backoff):
+    with Stubber(dynamodb_client) as stubber:
+        stubber.add_client_error("batch_write_item", "ProvisionedThroughputExceededException")
+        stubber.add_response("batch_write_item", {}, write_request("a"))
+        stats = dynamo_interface.batch_put_item_in_object_metadata_table([item("a")])
+        stubber.assert_no_pending_responses()
+    assert (stats.items_written, stats.batches, stats.retries, stats.throttles) == (1, 1, 1, 1)
+
+
+def test_batch_write_keeps_the_last_request_of_a_key(dynamo_interface, dynamodb_client):
+    with Stubber(dynamodb_client) as stubber:
+        request = write_request("a")
+        request["RequestItems"][TABLE][0]["PutRequest"]["Item"]["version"] = {"N": "2"}
+        stubber.add_response("batch_write_item", {}, request)
+        dynamo_interface.batch_put_item_in_object_metadata_table(
+            [{**item("a"), "version": 1}, {**item("a"), "version": 2}]
+        )
+        stubber.assert_no_pending_responses()
+
+
+def test_batch_write_gives_up_on_items_left_unprocessed(dynamo_interface, dynamodb_client, no_backoff):
+    with Stubber(dynamodb_client) as stubber:
+        for _ in range(9):
+            stubber.add_response("batch_write_item", {"UnprocessedItems": write_request("a")["RequestItems"]})
+        with pytest.raises(UnprocessedKeysException):
+            dynamo_interface.batch_put_item_in_object_metadata_table([item("a")])
+        stubber.assert_no_pending_responses()
+
+
+def test_batch_get_retries_unprocessed_keys_and_throttled_calls(dynamo_interface, dynamodb_client, no_backoff):
+    with Stubber(dynamodb_client) as stubber:
+        stubber.add_response(
+            "batch_get_item",
+            {"Responses": {TABLE: [serialized("a")]}, "UnprocessedKeys": get_request("b")["RequestItems"]},
+            get_request("a", "b"),
+        )
+        stubber.add_client_error("batch_get_item", "ThrottlingException")
+        stubber.add_response("batch_get_item", {"Responses": {TABLE: [serialized("b")]}}, get_request("b"))
+        items = list(dynamo_interface.batch_get_object_metadata("bucket", ["a", "b", "a"]))
+        stubber.assert_no_pending_responses()
+    assert sorted(items, key=lambda found: found["key"]) == [item("a"), item("b")]
+
+
+def test_batch_get_gives_up_on_keys_left_unprocessed(dynamo_interface, dynamodb_client, no_backoff):
+    with Stubber(dynamodb_client) as stubber:
+        for _ in range(9):
+            stubber.add_response(
+                "batch_get_item", {"Responses": {TABLE: []}, "UnprocessedKeys": get_request("a")["RequestItems"]}
+            )
+        with pytest.raises(UnprocessedKeysException):
+            list(dynamo_interface.batch_get_object_metadata("bucket", ["a"]))
+        stubber.assert_no_pending_responses()
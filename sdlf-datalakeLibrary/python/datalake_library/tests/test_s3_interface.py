@@ -0,0 +1,72 @@
+import threading
+
+import boto3
+import pytest
+from datalake_library.interfaces.s3_interface import ObjectCache
+
+moto = pytest.importorskip("moto")
+
+BUCKET = "sdlf-raw"
+# room for two of the 100-byte objects
+MAX_BYTES = 250
+
+
+@pytest.fixture
+def s3_client():
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        for index in range(4):
+            client.put_object(Bucket=BUCKET, Key=f"data/object-{index}", Body=b"x" * 100)
+        yield client
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ObjectCache(directory=str(tmp_path / "cache"), max_bytes=MAX_BYTES)
+
+
+def read(cache, s3_client, key):
+    with cache.get(s3_client, BUCKET, key) as path, open(path, "rb") as cached_file:
+        return cached_file.read()
+
+
+def test_cache_reuses_objects_with_an_unchanged_etag(cache, s3_client):
+    assert read(cache, s3_client, "data/object-0") == b"x" * 100
+    assert read(cache, s3_client, "data/object-0") == b"x" * 100
+    s3_client.put_object(Bucket=BUCKET, Key="data/object-0", Body=b"y" * 100)
+    assert read(cache, s3_client, "data/object-0") == b"y" * 100
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["bytes_downloaded"]) == (1, 2, 200)
+
+
+def test_cache_evicts_least_recently_used_objects(cache, s3_client):
+    for index in (0, 1, 2):
+        read(cache, s3_client, f"data/object-{index}")
+    stats = cache.stats()
+    assert (stats["cached_objects"], stats["cached_bytes"], stats["evictions"]) == (2, 200, 1)
+    # object-0 was evicted, object-2 is still cached
+    read(cache, s3_client, "data/object-2")
+    read(cache, s3_client, "data/object-0")
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 4)
+
+
+def test_cache_keeps_objects_in_use(cache, s3_client):
+    with cache.get(s3_client, BUCKET, "data/object-0") as path:
+        for index in (1, 2, 3):
+            read(cache, s3_client, f"data/object-{index}")
+        with open(path, "rb") as cached_file:
+            assert cached_file.read() == b"x" * 100
+    # released, the cache is back within max_bytes
+    assert cache.stats()["cached_bytes"] <= MAX_BYTES
+
+
+def test_cache_downloads_an_object_once_for_concurrent_readers(cache, s3_client):
+    threads = [threading.Thread(target=read, args=(cache, s3_client, "data/object-0")) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (cache.stats()["misses"], cache.stats()["hits"]) == (1, 7)
+    # fetch locks are dropped once no thread uses them
+    assert cache._key_locks == {}
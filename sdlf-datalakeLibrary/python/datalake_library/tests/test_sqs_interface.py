@@ -0,0 +1,84 @@
+import json
+import time
+
+import boto3
+import pytest
+from datalake_library.interfaces.sqs_interface import SQSInterface
+
+moto = pytest.importorskip("moto")
+
+QUEUE = "sdlf-main-queue"
+
+
+@pytest.fixture
+def sqs_client():
+    with moto.mock_aws():
+        client = boto3.client("sqs", region_name="us-east-1")
+        client.create_queue(QueueName=QUEUE, Attributes={"VisibilityTimeout": "30"})
+        yield client
+
+
+@pytest.fixture
+def queue_interface(sqs_client):
+    return SQSInterface(QUEUE, sqs_client=sqs_client)
+
+
+def send(sqs_client, count):
+    queue_url = sqs_client.get_queue_url(QueueName=QUEUE)["QueueUrl"]
+    for index in range(count):
+        sqs_client.send_message(QueueUrl=queue_url, MessageBody=json.dumps({"index": index}))
+    return queue_url
+
+
+def visible_messages(sqs_client, queue_url):
+    return sqs_client.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10, WaitTimeSeconds=0).get("Messages", [])
+
+
+def test_consumer_extends_visibility_of_messages_being_processed(queue_interface, sqs_client):
+    queue_url = send(sqs_client, 1)
+    with queue_interface.consume(visibility_timeout=2, wait_time_seconds=0) as consumer:
+        message = next(consumer)
+        # three times longer than the visibility timeout, the heartbeat keeps the message hidden
+        time.sleep(3)
+        assert visible_messages(sqs_client, queue_url) == []
+        consumer.ack(message)
+    assert (consumer.received, consumer.acked) == (1, 1)
+    assert visible_messages(sqs_client, queue_url) == []
+
+
+def test_consumer_releases_messages_never_handed_out(queue_interface, sqs_client):
+    count = 3
+    queue_url = send(sqs_client, count)
+    with queue_interface.consume(wait_time_seconds=0) as consumer:
+        message = next(consumer)
+        # the other messages are prefetched meanwhile
+        while consumer.received < count:
+            time.sleep(0.01)
+        consumer.ack(message)
+    released = visible_messages(sqs_client, queue_url)
+    assert sorted(json.loads(body["Body"])["index"] for body in released) == sorted(
+        index for index in range(count) if index != json.loads(message["Body"])["index"]
+    )
+
+
+def test_consumer_leaves_unacknowledged_messages_in_the_queue(queue_interface, sqs_client):
+    queue_url = send(sqs_client, 2)
+    with queue_interface.consume(visibility_timeout=1, wait_time_seconds=0) as consumer:
+        messages = list(consumer)
+    assert (len(messages), consumer.acked) == (2, 0)
+    time.sleep(1.1)
+    assert len(visible_messages(sqs_client, queue_url)) == len(messages)
+
+
+def test_drain_receives_and_deletes_messages(queue_interface, sqs_client):
+    queue_url = send(sqs_client, 25)
+    messages = queue_interface.drain(30, max_workers=3, wait_time_seconds=0)
+    assert sorted(json.loads(message["Body"])["index"] for message in messages) == list(range(25))
+    assert visible_messages(sqs_client, queue_url) == []
+
+
+def test_drain_stops_at_max_messages(queue_interface, sqs_client):
+    queue_url = send(sqs_client, 25)
+    first, rest = queue_interface.drain(10, wait_time_seconds=0), queue_interface.drain(30, wait_time_seconds=0)
+    assert (len(first), len(rest)) == (10, 15)
+    assert visible_messages(sqs_client, queue_url) == []
@@ -0,0 +1,91 @@
+import json
+
+import boto3
+import pytest
+from botocore.stub import ANY, Stubber
+from datalake_library.commons import TokenBucket
+from datalake_library.datalake_exceptions import ExecutionStartFailedException
+from datalake_library.interfaces.states_interface import StatesInterface
+
+MACHINE_ARN = "arn:aws:states:us-east-1:123456789012:stateMachine:sdlf-main-sm"
+EXECUTION_ARN = "arn:aws:states:us-east-1:123456789012:execution:sdlf-main-sm"
+
+
+@pytest.fixture
+def states_client():
+    return boto3.client("stepfunctions", region_name="us-east-1")
+
+
+@pytest.fixture
+def states_interface(states_client):
+    return StatesInterface(states_client=states_client)
+
+
+def start_executions(states_interface, inputs, **kwargs):
+    # a single call in flight, stubbed responses are consumed in order
+    return states_interface.start_executions(
+        MACHINE_ARN, inputs, max_workers=1, rate_limiter=TokenBucket(1000), **kwargs
+    )
+
+
+def start_request(name, message):
+    return {"stateMachineArn": MACHINE_ARN, "name": name, "input": json.dumps(message)}
+
+
+def started(name):
+    return {"executionArn": f"{EXECUTION_ARN}:{name}", "startDate": "2024-01-01T00:00:00Z"}
+
+
+def test_start_executions_returns_existing_executions(states_interface, states_client):
+    with Stubber(states_client) as stubber:
+        stubber.add_response("start_execution", started("m1"), start_request("m1", {"a": 1}))
+        stubber.add_client_error(
+            "start_execution", "ExecutionAlreadyExists", expected_params=start_request("m2", {"a": 2})
+        )
+        results = start_executions(states_interface, [{"a": 1}, {"a": 2}], names=["m1", "m2"])
+        stubber.assert_no_pending_responses()
+    assert [(result.execution_arn, result.already_started, result.error) for result in results] == [
+        (f"{EXECUTION_ARN}:m1", False, None),
+        (f"{EXECUTION_ARN}:m2", True, None),
+    ]
+
+
+def test_start_executions_retries_throttled_calls(states_interface, states_client, no_backoff):
+    with Stubber(states_client) as stubber:
+        stubber.add_client_error("start_execution", "ThrottlingException", expected_params=start_request("m1", {}))
+        stubber.add_client_error("start_execution", "ThrottlingException", expected_params=start_request("m1", {}))
+        stubber.add_response("start_execution", started("m1"), start_request("m1", {}))
+        (result,) = start_executions(states_interface, [{}], names=["m1"])
+        stubber.assert_no_pending_responses()
+    assert result.execution_arn == f"{EXECUTION_ARN}:m1"
+
+
+def test_start_executions_reports_calls_still_throttled(states_interface, states_client, no_backoff):
+    with Stubber(states_client) as stubber:
+        for _ in range(3):
+            stubber.add_client_error("start_execution", "ThrottlingException")
+        (result,) = start_executions(states_interface, [{}], names=["m1"], max_retries=2, raise_on_failure=False)
+        stubber.assert_no_pending_responses()
+    assert (result.execution_arn, result.error) == (None, "ThrottlingException")
+
+
+def test_start_executions_raises_on_failure(states_interface, states_client):
+    with Stubber(states_client) as stubber:
+        stubber.add_client_error("start_execution", "InvalidExecutionInput")
+        with pytest.raises(ExecutionStartFailedException):
+            start_executions(states_interface, [{}], names=["m1"])
+
+
+def test_start_executions_starts_repeated_inputs_once(states_interface, states_client):
+    with Stubber(states_client) as stubber:
+        stubber.add_response(
+            "start_execution", started("hash"), {"stateMachineArn": MACHINE_ARN, "name": ANY, "input": "{}"}
+        )
+        results = start_executions(states_interface, [{}, {}])
+        stubber.assert_no_pending_responses()
+    assert results[0] == results[1]
+
+
+def test_start_executions_rejects_different_inputs_with_the_same_name(states_interface, states_client):
+    with Stubber(states_client), pytest.raises(ValueError):
+        start_executions(states_interface, [{"a": 1}, {"a": 2}], names=["m1", "m1"])
@@ -28,22 +28,26 @@ def lambda_handler(event, context):
             peh_table_instance=peh_table_instance,
             manifests_table_instance=manifests_table_instance,
         )
-        peh_id = event[0]["Items"][0]["transform"]["peh_id"]
-        pipeline_execution.retrieve_pipeline_execution(peh_id)
-
-        partial_failure = False
-        # for records in event:
-        #     for record in records:
-        #         if "processed" not in record or not record["processed"]:
-        #             partial_failure = True
-
-        if not partial_failure:
-            pipeline_execution.update_pipeline_execution(
-                status=f"{deployment_instance} {component} Processing", component=component
-            )
-            pipeline_execution.end_pipeline_execution_success()
-        else:
-            raise Exception("Failure: Processing failed for one or more record")
+        # status updates are buffered and written to the pipeline execution history in one go by flush
+        with pipeline_execution:
+            peh_id = event[0]["Items"][0]["transform"]["peh_id"]
+            pipeline_execution.retrieve_pipeline_execution(peh_id)
+
+            partial_failure = False
+            # for records in event:
+            #     for record in records:
+            #         if "processed" not in record or not record["processed"]:
+            #             partial_failure = True
+
+            if not partial_failure:
+                pipeline_execution.update_pipeline_execution(
+                    status=f"{deployment_instance} {component} Processing", component=component
+                )
+                pipeline_execution.end_pipeline_execution_success()
+            else:
+                raise Exception("Failure: Processing failed for one or more record")
+            # inside the try, a failed write still marks the execution as failed
+            pipeline_execution.flush()
 
     except Exception as e:
         logger.error("Fatal error", exc_info=True)
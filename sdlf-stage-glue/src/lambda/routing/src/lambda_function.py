@@ -6,9 +6,13 @@ from datalake_library.commons import init_logger
 from datalake_library.interfaces.sqs_interface import SQSInterface
 from datalake_library.interfaces.states_interface import StatesInterface
 from datalake_library.sdlf import (
+    MicroBatchAggregator,
     PipelineExecutionHistoryAPI,
+    SQSBuffer,
     SQSConfiguration,
     StateMachineConfiguration,
+    aggregation_policy_from_env,
+    aggregator_from_env,
 )
 
 logger = init_logger(__name__)
@@ -16,6 +20,9 @@ deployment_instance = os.environ["DEPLOYMENT_INSTANCE"]
 dataset_deployment_instance = peh_table_instance = manifests_table_instance = os.environ["DATASET_DEPLOYMENT_INSTANCE"]
 
 
+aggregation_key = f"{dataset_deployment_instance}-{deployment_instance}"
+
+
 def serializer(obj):
     if isinstance(obj, Decimal):
         if obj.as_integer_ratio()[1] == 1:
@@ -39,7 +46,8 @@ def pipeline_start(pipeline_execution, event):
 # event: run stage when an event received on the team's event bus matches the configured event pattern
 # event-schedule: store events received on the team's event bus matching the configured event pattern, then process them on the configured schedule
 # schedule: run stage on the configured schedule, without any event as input
-def get_source_records(event):
+# aggregation-flush: process the events buffered by an event stage (SDLF_AGGREGATION_BUFFER) that waited long enough
+def get_source_records(event, pipeline_execution):
     records = []
 
     if event.get("trigger_type") == "schedule" and "event_pattern" not in event:
@@ -47,25 +55,31 @@ def get_source_records(event):
         records.append(event)
     elif event.get("trigger_type") == "schedule" and "event_pattern" in event:
         logger.info("Stage trigger: event-schedule")
-        min_items_to_process = 1
-        max_items_to_process = 100
         logger.info(f"Pipeline is {deployment_instance}")
-        logger.info(
-            f"Pipeline stage configuration: min_items_to_process {min_items_to_process}, max_items_to_process {max_items_to_process}"
-        )
-
+        # the stage queue buffers the events, the aggregation policy (SDLF_AGGREGATION_* env variables) decides
+        # whether they are processed on this run
         sqs_config = SQSConfiguration(instance=deployment_instance)
-        queue_interface = SQSInterface(sqs_config.stage_queue)
+        aggregator = MicroBatchAggregator(
+            SQSBuffer(SQSInterface(sqs_config.stage_queue), aggregation_key),
+            aggregation_policy_from_env(pipeline_execution, deployment_instance),
+        )
         logger.info(f"Querying {deployment_instance} objects waiting for processing")
-        messages = queue_interface.receive_min_max_messages(min_items_to_process, max_items_to_process)
-        logger.info(f"{len(messages)} Objects ready for processing")
-
-        for record in messages:
-            records.append(json.loads(record))
+        records.extend(aggregator.flush(aggregation_key))
+        logger.info(f"{len(records)} Objects ready for processing")
     elif "Records" in event:
         logger.info("Stage trigger: event")
-        for record in event["Records"]:
-            records.append(json.loads(record["body"]))
+        event_records = [json.loads(record["body"]) for record in event["Records"]]
+        aggregator = aggregator_from_env(aggregation_key)
+        if aggregator:
+            records.extend(aggregator.add(aggregation_key, event_records))
+        else:
+            records.extend(event_records)
+    elif event.get("trigger_type") == "aggregation-flush":
+        logger.info("Stage trigger: aggregation-flush")
+        aggregator = aggregator_from_env(aggregation_key)
+        if aggregator:
+            records.extend(aggregator.flush_stale(aggregation_key))
+        logger.info(f"{len(records)} Objects ready for processing")
     else:
         raise Exception("Unable to ascertain trigger type (schedule, event-schedule or event)")
 
@@ -96,7 +110,7 @@ def lambda_handler(event, context):
             manifests_table_instance=manifests_table_instance,
         )
         peh_id = pipeline_start(pipeline_execution, event)
-        records = get_source_records(event)
+        records = get_source_records(event, pipeline_execution)
         metadata = get_transform_details()
         metadata = dict(peh_id=peh_id, **metadata)
         records = enrich_records(records, metadata)
@@ -111,7 +125,7 @@ def lambda_handler(event, context):
                 state_config.stage_state_machine, json.dumps(records, default=serializer)
             )
             pipeline_execution.update_pipeline_execution(
-                status=f"{deployment_instance} Transform Processing", component="Transform"
+                status=f"{deployment_instance} Transform Processing", component="Transform", item_count=len(records)
             )
         else:
             logger.info("Nothing to process, exiting pipeline")
@@ -1,12 +1,14 @@
 import json
 import os
 
+from datalake_library.claim_check import ClaimCheck
 from datalake_library.commons import init_logger
 from datalake_library.interfaces.sqs_interface import SQSInterface
-from datalake_library.sdlf import SQSConfiguration
+from datalake_library.sdlf import S3Configuration, SQSConfiguration
 
 logger = init_logger(__name__)
 deployment_instance = os.environ["DEPLOYMENT_INSTANCE"]
+storage_deployment_instance = os.environ["STORAGE_DEPLOYMENT_INSTANCE"]
 
 
 def lambda_handler(event, context):
@@ -15,7 +17,10 @@ def lambda_handler(event, context):
             event = json.loads(event)
 
         sqs_config = SQSConfiguration(instance=deployment_instance)
-        sqs_interface = SQSInterface(sqs_config.stage_dlq)
+        artifacts_bucket = S3Configuration(instance=storage_deployment_instance).artifacts_bucket
+        # payloads above 192 KB are stored in the artifacts bucket, the routing Lambda rehydrates them once redriven
+        claim_check = ClaimCheck(artifacts_bucket, prefix=f"claim-check/{deployment_instance}")
+        sqs_interface = SQSInterface(sqs_config.stage_dlq, claim_check=claim_check)
 
         logger.info("Execution Failed. Sending original payload to DLQ")
         sqs_interface.send_message_to_fifo_queue(json.dumps(event), "failed")
@@ -12,17 +12,15 @@ def lambda_handler(event, context):
     try:
         sqs_config = SQSConfiguration(instance=deployment_instance)
         dlq_interface = SQSInterface(sqs_config.stage_dlq)
-        messages = dlq_interface.receive_messages(1)
-        if not messages:
-            logger.info("No messages found in {}".format(sqs_config.get_stage_dlq_name))
-            return
-
-        logger.info("Received {} messages".format(len(messages)))
         queue_interface = SQSInterface(sqs_config.stage_queue)
-        for message in messages:
-            queue_interface.send_message_to_fifo_queue(message["Body"], "redrive")
-            logger.info("Redrive message succeeded")
+        # messages are deleted from the DLQ only once sent back to the stage queue
+        with dlq_interface.consume(max_messages=1, wait_time_seconds=1) as messages:
+            for message in messages:
+                queue_interface.send_message_to_fifo_queue(message["Body"], "redrive")
+                messages.ack(message)
+                logger.info("Redrive message succeeded")
+        if not messages.received:
+            logger.info("No messages found in {}".format(sqs_config.stage_dlq))
     except Exception as e:
         logger.error("Fatal error", exc_info=True)
         raise e
-    return
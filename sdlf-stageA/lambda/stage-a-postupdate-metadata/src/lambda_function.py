@@ -40,13 +40,13 @@ def lambda_handler(event, context):
 
         logger.info("Storing metadata to DynamoDB")
         bucket = S3Configuration().stage_bucket
-        for key in processed_keys:
-            size, last_modified_date = S3Interface().get_size_and_last_modified(bucket, key)
+        s3_interface = S3Interface()
+        for processed_object in s3_interface.get_objects_metadata(bucket, processed_keys):
             object_metadata = {
                 "bucket": bucket,
-                "key": key,
-                "size": size,
-                "last_modified_date": last_modified_date,
+                "key": processed_object.key,
+                "size": processed_object.size,
+                "last_modified_date": processed_object.last_modified.isoformat(),
                 "org": event["body"]["org"],
                 "app": event["body"]["domain"],
                 "env": event["body"]["env"],
@@ -11,17 +11,19 @@ logger = init_logger(__name__)
 def lambda_handler(event, context):
     try:
         logger.info("Received {} messages".format(len(event["Records"])))
+        pipeline = os.environ["PIPELINE"]
+        pipeline_stage = os.environ["PIPELINE_STAGE"]
+        org = os.environ["ORG"]
+        domain = os.environ["DOMAIN"]
+        env = os.environ["ENV"]
+        # executions are started in bulk per state machine, named after the SQS message they come from so that
+        # a redelivered message does not start a second execution
+        executions = {}
         for record in event["Records"]:
-            logger.info("Starting State Machine Execution")
             event_body = json.loads(record["body"])
             object_key = event_body["object"]["key"].split("/")
             team = object_key[0]
             dataset = object_key[1]
-            pipeline = os.environ["PIPELINE"]
-            pipeline_stage = os.environ["PIPELINE_STAGE"]
-            org = os.environ["ORG"]
-            domain = os.environ["DOMAIN"]
-            env = os.environ["ENV"]
 
             event_with_pipeline_details = {
                 **event_body["object"],
@@ -36,9 +38,14 @@ def lambda_handler(event, context):
             }
 
             state_config = StateMachineConfiguration(team, pipeline, pipeline_stage)
-            StatesInterface().run_state_machine(
-                state_config.get_stage_state_machine_arn, json.dumps(event_with_pipeline_details)
-            )
+            inputs, names = executions.setdefault(state_config.get_stage_state_machine_arn, ([], []))
+            inputs.append(json.dumps(event_with_pipeline_details))
+            names.append(record["messageId"])
+
+        states_interface = StatesInterface()
+        for state_machine_arn, (inputs, names) in executions.items():
+            logger.info("Starting {} State Machine Executions".format(len(inputs)))
+            states_interface.start_executions(state_machine_arn, inputs, names=names)
     except Exception as e:
         logger.error("Fatal error", exc_info=True)
         raise e
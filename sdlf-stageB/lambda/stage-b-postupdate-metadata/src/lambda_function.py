@@ -26,8 +26,8 @@ def lambda_handler(event, context):
         stage = event["body"]["pipeline_stage"]
         dataset = event["body"]["dataset"]
         peh_id = event["body"]["peh_id"]
-        processed_keys_path = f"post-stage/{team}/{dataset}"
-        processed_keys = S3Interface().list_objects(bucket, processed_keys_path)
+        processed_keys_path = f"post-stage/{team}/{dataset}/"
+        s3_interface = S3Interface()
 
         logger.info("Initializing Octagon client")
         component = context.function_name.split("-")[-2].title()
@@ -42,13 +42,13 @@ def lambda_handler(event, context):
 
         logger.info("Storing metadata to DynamoDB")
         all_objects_metadata = []
-        for key in processed_keys:
-            size, last_modified_date = S3Interface().get_size_and_last_modified(bucket, key)
+        # size and last modified date come with the listing, no HEAD request per object
+        for processed_object in s3_interface.iter_objects(bucket, processed_keys_path):
             object_metadata = {
                 "bucket": bucket,
-                "key": key,
-                "size": size,
-                "last_modified_date": last_modified_date,
+                "key": processed_object.key,
+                "size": processed_object.size,
+                "last_modified_date": processed_object.last_modified.isoformat(),
                 "org": event["body"]["org"],
                 "app": event["body"]["domain"],
                 "env": event["body"]["env"],
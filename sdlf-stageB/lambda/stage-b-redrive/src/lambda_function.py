@@ -24,12 +24,18 @@ def lambda_handler(event, context):
             return
 
         logger.info("Received {} messages".format(len(messages)))
+        responses = []
         for message in messages:
-            logger.info("Starting State Machine Execution")
             if isinstance(message["Body"], str):
                 response = json.loads(message["Body"])
-            StatesInterface().run_state_machine(state_config.get_stage_state_machine_arn, response)
-            logger.info("Redrive message succeeded")
+            responses.append(response)
+        logger.info("Starting State Machine Executions")
+        StatesInterface().start_executions(
+            state_config.get_stage_state_machine_arn,
+            responses,
+            names=[message["MessageId"] for message in messages],
+        )
+        logger.info("Redrive message succeeded")
     except Exception as e:
         logger.error("Fatal error", exc_info=True)
         raise e